@@ -4,26 +4,35 @@
 
 import argparse
 import io
+import os
 import sys
 import codecs
 import platform
+import threading
+import multiprocessing
+from multiprocessing.pool import ThreadPool
 
 import colorama
 from colorama import Fore, Back
-import xlrd
 
 from .version import __version__
 from .config import config
-from .import_records import ImportRecords
+from .import_records import do_import
 from .export_records import ExportRecords
 from .transactions import TransactionHistory
 from .audit import AuditRecords
 from .price.valueasset import ValueAsset
+from .price.pricedata import PriceData
 from .price.exceptions import DataSourceError
-from .tax import TaxCalculator, CalculateCapitalGains as CCG
-from .report import ReportLog, ReportPdf
+from .tax import TaxCalculator, CalculateCapitalGains as CCG, PRECISION
+from .taxstate import TaxState
+from .fixedpoint import C_DECIMAL
+from .scenario import Scenario, process_scenarios
+from .report import ReportLog, ReportPdf, ReportScenarios
 from .exceptions import ImportFailureError
 
+BATCH_FILE_EXTENSIONS = ('.xlsx', '.xls', '.csv')
+
 if sys.stdout.encoding != 'UTF-8':
     if sys.version_info[:2] >= (3, 7):
         sys.stdout.reconfigure(encoding='utf-8')
@@ -48,6 +57,10 @@ def main():
                         '--debug',
                         action='store_true',
                         help="enable debug logging")
+    parser.add_argument('--offline',
+                        action='store_true',
+                        help="only use prices which have already been cached, nothing is "
+                             "downloaded")
     parser.add_argument('-ty',
                         '--taxyear',
                         type=validate_year,
@@ -67,6 +80,30 @@ def main():
                         dest='skip_integrity',
                         action='store_true',
                         help="skip integrity check")
+    parser.add_argument('-j',
+                        '--jobs',
+                        type=validate_jobs,
+                        help="number of processes used to calculate capital gains, "
+                             "assets (or scenarios) are processed in parallel, default: 1 "
+                             "(or 1 per scenario, up to the number of CPUs)")
+    parser.add_argument('--incremental',
+                        action='store_true',
+                        help="reuse capital gains calculated by a previous run for any assets "
+                             "whose transactions are unchanged")
+    parser.add_argument('--fixedpoint',
+                        action='store_true',
+                        help="use fixed-point integer arithmetic to calculate capital gains")
+    parser.add_argument('--crosscheck',
+                        action='store_true',
+                        help="check capital gains calculated using fixed-point arithmetic "
+                             "agree with the decimal calculation")
+    parser.add_argument('--scenario',
+                        type=validate_scenario,
+                        action='append',
+                        metavar='TAX_RULES[:SETTING=VALUE,...]',
+                        help="compare the capital gains calculated using the tax rules "
+                             "(--taxrules) with those of another scenario, SETTING can be "
+                             "{%s}, can be repeated" % ','.join(Scenario.CONFIG_NAMES))
     parser.add_argument('--summary',
                         action='store_true',
                         help="only output the capital gains summary in the tax report")
@@ -80,9 +117,30 @@ def main():
     parser.add_argument('--export',
                         action='store_true',
                         help="export your transaction records populated with price data")
+    parser.add_argument('--batch',
+                        dest='batch_path',
+                        type=str,
+                        help="process each client file in a directory, or listed in a manifest "
+                             "file, sharing the same price data, a PDF report is created for "
+                             "each client (-o specifies the output directory)")
 
     args = parser.parse_args()
     config.debug = args.debug
+    config.offline = args.offline
+
+    if args.batch_path and (args.filename or args.nopdf or args.export or args.scenario):
+        parser.error("argument --batch: not allowed with filename, --nopdf, --export or "
+                     "--scenario")
+
+    if config.debug and (args.fixedpoint or args.crosscheck):
+        # Debug logging formats Decimal values
+        parser.error("argument --fixedpoint/--crosscheck: not allowed with --debug")
+
+    if args.fixedpoint and C_DECIMAL and not args.crosscheck:
+        print("%sWARNING%s Decimal arithmetic is faster than fixed-point with this version of "
+              "Python, --fixedpoint is ignored" % (
+                  Back.YELLOW+Fore.BLACK, Back.RESET+Fore.YELLOW))
+        args.fixedpoint = False
 
     if config.debug:
         print("%s%s v%s" % (Fore.YELLOW, parser.prog, __version__))
@@ -94,6 +152,29 @@ def main():
         config.start_of_year_month = config.TAX_RULES_UK_COMPANY.index(args.tax_rules) + 1
         config.start_of_year_day = 1
 
+    if args.batch_path:
+        try:
+            batch_filenames = get_batch_filenames(args.batch_path)
+        except IOError:
+            parser.exit("%sERROR%s File could not be read: %s" % (
+                Back.RED+Fore.BLACK, Back.RESET+Fore.RED, args.batch_path))
+
+        try:
+            results = do_batch(parser.prog, batch_filenames, args)
+        except DataSourceError as e:
+            parser.exit("%sERROR%s %s" % (
+                Back.RED+Fore.BLACK, Back.RESET+Fore.RED, e))
+
+        for filename, error in results:
+            if error:
+                print("%sERROR%s %s: %s" % (
+                    Back.RED+Fore.BLACK, Back.RESET+Fore.RED, filename, error))
+
+        print("%sbatch %s (success=%s, failure=%s)" % (
+            Fore.WHITE, 'successful' if all(not error for _, error in results) else 'failure',
+            len([r for r in results if not r[1]]), len([r for r in results if r[1]])))
+        parser.exit()
+
     try:
         transaction_records = do_import(args.filename)
     except IOError:
@@ -103,13 +184,41 @@ def main():
         parser.exit()
 
     if args.export:
-        do_export(transaction_records)
+        try:
+            do_export(transaction_records)
+        except DataSourceError as e:
+            parser.exit("%sERROR%s %s" % (
+                Back.RED+Fore.BLACK, Back.RESET+Fore.RED, e))
         parser.exit()
 
     audit = AuditRecords(transaction_records)
 
+    if args.scenario:
+        try:
+            results = do_scenarios(transaction_records,
+                                   [Scenario(args.tax_rules)] + args.scenario,
+                                   args.skip_integrity,
+                                   args.jobs)
+        except DataSourceError as e:
+            parser.exit("%sERROR%s %s" % (
+                Back.RED+Fore.BLACK, Back.RESET+Fore.RED, e))
+
+        if not args.skip_integrity:
+            int_passed = do_integrity_check(audit, results[0].holdings)
+            if not int_passed:
+                parser.exit()
+
+        ReportScenarios(results)
+        parser.exit()
+
     try:
-        tax, value_asset = do_tax(transaction_records, args.tax_rules, args.skip_integrity)
+        tax, value_asset = do_tax(transaction_records, args.tax_rules, args.skip_integrity,
+                                  args.jobs or 1, args.incremental,
+                                  args.fixedpoint or args.crosscheck,
+                                  filename=args.filename)
+        if args.crosscheck:
+            do_cross_check(tax, args.tax_rules, args.skip_integrity)
+
         if not args.skip_integrity:
             int_passed = do_integrity_check(audit, tax.holdings)
             if not int_passed:
@@ -152,45 +261,212 @@ def validate_year(value):
 
     return year
 
-def do_import(filename):
-    import_records = ImportRecords()
+def validate_scenario(value):
+    try:
+        return Scenario.parse(value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
 
-    if filename:
-        try:
-            import_records.import_excel(filename)
-        except xlrd.XLRDError:
-            with io.open(filename, newline='', encoding='utf-8') as csv_file:
-                import_records.import_csv(csv_file)
+def validate_jobs(value):
+    jobs = int(value)
+    if jobs < 1:
+        raise argparse.ArgumentTypeError("number of jobs must be at least 1")
+
+    return jobs
+
+def do_tax(transaction_records, tax_rules, skip_integrity_check, jobs=1, incremental=False,
+           fixed_point=False, price_data=None, filename=None):
+    value_asset = ValueAsset(price_data=price_data)
+    transaction_history = TransactionHistory(transaction_records, value_asset)
+
+    tax = TaxCalculator(transaction_history.transactions, tax_rules, fixed_point)
+
+    if (jobs > 1 or incremental) and not config.debug:
+        tax.process_disposals_by_asset(skip_integrity_check,
+                                       jobs,
+                                       TaxState(filename) if incremental else None)
     else:
-        if sys.version_info[0] < 3:
-            import_records.import_csv(codecs.getreader('utf-8')(sys.stdin))
-        else:
-            import_records.import_csv(sys.stdin)
+        # Debug logging is only readable when processed in order
+        tax.process_disposals(skip_integrity_check)
+
+    return tax, value_asset
+
+def do_cross_check(tax, tax_rules, skip_integrity_check):
+    tax_decimal = TaxCalculator(tax.transactions, tax_rules)
+    tax_decimal.process_disposals(skip_integrity_check)
+
+    mismatches = []
+    for tax_year in sorted(set(tax.tax_events) | set(tax_decimal.tax_events)):
+        tax_events = capital_gains(tax.tax_events.get(tax_year, []))
+        tax_events_decimal = capital_gains(tax_decimal.tax_events.get(tax_year, []))
+        if tax_events != tax_events_decimal:
+            mismatches.append(config.format_tax_year(tax_year))
+
+    for asset in sorted(set(tax.holdings) | set(tax_decimal.holdings)):
+        if holding(tax.holdings.get(asset)) != holding(tax_decimal.holdings.get(asset)):
+            mismatches.append(asset)
 
-    print("%simport %s (success=%s, failure=%s)" % (
-        Fore.WHITE, 'successful' if import_records.failure_cnt <= 0 else 'failure',
-        import_records.success_cnt, import_records.failure_cnt))
+    print("%scross-check: %s%s" % (
+        Fore.CYAN, Fore.YELLOW, 'failed' if mismatches else 'passed'))
 
-    if import_records.failure_cnt > 0:
-        raise ImportFailureError
+    if mismatches:
+        print("%sWARNING%s Cross-check failed: fixed-point and decimal calculations differ "
+              "for %s" % (Back.YELLOW+Fore.BLACK, Back.RESET+Fore.YELLOW, ', '.join(mismatches)))
 
-    return import_records.get_records()
+def capital_gains(tax_events):
+    # Compared to the precision reported, order can differ if assets are processed separately
+    return sorted((te.asset, te.date, te.disposal_type, te.quantity, te.cost, te.fees,
+                   te.proceeds, te.gain) for te in tax_events)
 
-def do_tax(transaction_records, tax_rules, skip_integrity_check):
+def holding(h):
+    if h is None:
+        return None
+    return h.quantity, (h.cost + h.fees).quantize(PRECISION)
+
+def do_scenarios(transaction_records, scenarios, skip_integrity_check, jobs=None):
     value_asset = ValueAsset()
-    transaction_history = TransactionHistory(transaction_records, value_asset)
 
-    tax = TaxCalculator(transaction_history.transactions, tax_rules)
-    tax.pool_same_day()
-    tax.match_sell(tax.DISPOSAL_SAME_DAY)
+    if jobs is None:
+        jobs = min(len(scenarios), multiprocessing.cpu_count())
 
-    if tax_rules == config.TAX_RULES_UK_INDIVIDUAL:
-        tax.match_buyback(tax.DISPOSAL_BED_AND_BREAKFAST)
-    elif tax_rules in config.TAX_RULES_UK_COMPANY:
-        tax.match_sell(tax.DISPOSAL_TEN_DAY)
+    if config.debug:
+        # Debug logging is only readable when processed in order
+        jobs = 1
 
-    tax.process_section104(skip_integrity_check)
-    return tax, value_asset
+    return process_scenarios(transaction_records, scenarios, value_asset,
+                             skip_integrity_check, jobs)
+
+def get_batch_filenames(batch_path):
+    if os.path.isdir(batch_path):
+        return [os.path.join(batch_path, filename)
+                for filename in sorted(os.listdir(batch_path))
+                if os.path.splitext(filename)[1].lower() in BATCH_FILE_EXTENSIONS]
+
+    # Manifest of filenames, one per line, relative to the manifest
+    batch_filenames = []
+    with io.open(batch_path, encoding='utf-8') as manifest_file:
+        for line in manifest_file:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                batch_filenames.append(os.path.join(os.path.dirname(batch_path), line))
+
+    return batch_filenames
+
+def do_batch(progname, batch_filenames, args):
+    # Clients are processed in threads so they can share the same price data, and its data
+    #  sources, each is only loaded (or downloaded) once
+    price_data = PriceData(ValueAsset.data_sources_required())
+
+    if args.output_filename and not os.path.exists(args.output_filename):
+        os.makedirs(args.output_filename)
+
+    if config.debug:
+        # Debug logging is only readable when processed in order
+        jobs = 1
+    else:
+        jobs = args.jobs or 1
+
+    batch_output = BatchOutput(sys.stdout)
+    sys.stdout = batch_output
+    pool = ThreadPool(min(jobs, max(1, len(batch_filenames))))
+    try:
+        return pool.map(lambda filename: do_batch_client(progname, filename, args, price_data,
+                                                         batch_output),
+                        batch_filenames)
+    finally:
+        pool.close()
+        pool.join()
+        sys.stdout = batch_output.stdout
+
+def do_batch_client(progname, filename, args, price_data, batch_output):
+    batch_output.begin()
+    try:
+        return do_client(progname, filename, args, price_data)
+    except Exception as e:
+        # Any other error only fails this client, the rest of the batch carries on
+        return filename, "%s: %s" % (type(e).__name__, e)
+    finally:
+        batch_output.end("%sclient: %s%s" % (Fore.WHITE, Fore.YELLOW, filename))
+
+def do_client(progname, filename, args, price_data):
+    try:
+        transaction_records = do_import(filename)
+    except IOError:
+        return filename, "File could not be read"
+    except ImportFailureError:
+        return filename, "Import failed"
+
+    audit = AuditRecords(transaction_records)
+
+    try:
+        tax, value_asset = do_tax(transaction_records, args.tax_rules, args.skip_integrity,
+                                  1, args.incremental, args.fixedpoint or args.crosscheck,
+                                  price_data, filename)
+        if args.crosscheck:
+            do_cross_check(tax, args.tax_rules, args.skip_integrity)
+
+        if not args.skip_integrity:
+            if not do_integrity_check(audit, tax.holdings):
+                return filename, "Integrity check failed"
+
+        if not args.summary:
+            tax.process_income()
+
+        do_each_tax_year(tax,
+                         args.taxyear,
+                         args.summary,
+                         value_asset)
+    except DataSourceError as e:
+        return filename, str(e)
+
+    client_args = argparse.Namespace(**vars(args))
+    client_args.output_filename = os.path.join(args.output_filename or os.path.dirname(filename),
+                                               os.path.splitext(os.path.basename(filename))[0])
+    ReportPdf(progname,
+              audit,
+              tax.tax_report,
+              value_asset.price_report,
+              tax.holdings_report,
+              client_args)
+    return filename, None
+
+class BatchOutput(object):
+    # Output from each client's thread is held until the client is done, then written in one
+    #  piece under its filename, so clients processed together don't interleave
+    def __init__(self, stdout):
+        self.stdout = stdout
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def begin(self):
+        self.local.buffer = []
+
+    def end(self, heading):
+        with self.lock:
+            self.stdout.write("%s\n%s" % (heading, ''.join(self.local.buffer)))
+            self.stdout.flush()
+
+        self.local.buffer = None
+
+    def write(self, text):
+        if getattr(self.local, 'buffer', None) is not None:
+            self.local.buffer.append(text)
+        else:
+            with self.lock:
+                self.stdout.write(text)
+
+    def flush(self):
+        if getattr(self.local, 'buffer', None) is None:
+            self.stdout.flush()
+
+    def isatty(self):
+        # Progress bars and spinners can't be held, so they are turned off for clients
+        if getattr(self.local, 'buffer', None) is not None:
+            return False
+        return self.stdout.isatty()
+
+    def __getattr__(self, name):
+        return getattr(self.stdout, name)
 
 def do_integrity_check(audit, holdings):
     int_passed = True
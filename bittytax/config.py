@@ -21,6 +21,7 @@ class Config(object):
     BITTYTAX_PATH = os.path.expanduser('~/.bittytax')
     BITTYTAX_CONFIG = 'bittytax.conf'
     CACHE_DIR = os.path.join(BITTYTAX_PATH, 'cache')
+    STATE_DIR = os.path.join(BITTYTAX_PATH, 'state')
 
     FIAT_LIST = ['GBP', 'EUR', 'USD']
     CRYPTO_LIST = ['BTC', 'ETH', 'XRP', 'LTC', 'BCH', 'USDT']
@@ -61,12 +62,15 @@ class Config(object):
         'data_source_fiat': DATA_SOURCE_FIAT,
         'data_source_crypto': DATA_SOURCE_CRYPTO,
         'coinbase_zero_fees_are_gifts': False,
+        'asset_list_ttl': 24,
     }
 
     def __init__(self):
         self.debug = False
+        self.offline = False
         self.start_of_year_month = 4
         self.start_of_year_day = 6
+        self.tax_year_boundaries = {}
 
         if not os.path.exists(Config.BITTYTAX_PATH):
             os.mkdir(Config.BITTYTAX_PATH)
@@ -120,6 +124,25 @@ class Config(object):
         raise ValueError("Currency not supported")
 
     def get_tax_year_start(self, tax_year):
+        return self._get_tax_year_boundaries(tax_year)[0]
+
+    def get_tax_year_end(self, tax_year):
+        return self._get_tax_year_boundaries(tax_year)[1]
+
+    def which_tax_year(self, timestamp):
+        if timestamp > self._get_tax_year_boundaries(timestamp.year)[1]:
+            return timestamp.year + 1
+        return timestamp.year
+
+    def _get_tax_year_boundaries(self, tax_year):
+        # Keyed by the start of year as well, since this is changed by the tax rules
+        key = (self.start_of_year_month, self.start_of_year_day, tax_year)
+        if key not in self.tax_year_boundaries:
+            self.tax_year_boundaries[key] = (self._tax_year_start(tax_year),
+                                             self._tax_year_end(tax_year))
+        return self.tax_year_boundaries[key]
+
+    def _tax_year_start(self, tax_year):
         if self.start_of_year_month != 1:
             return datetime(tax_year - 1,
                             self.start_of_year_month,
@@ -130,7 +153,7 @@ class Config(object):
                         self.start_of_year_day,
                         tzinfo=config.TZ_LOCAL)
 
-    def get_tax_year_end(self, tax_year):
+    def _tax_year_end(self, tax_year):
         if self.start_of_year_month == 1:
             return datetime(tax_year + 1,
                             self.start_of_year_month,
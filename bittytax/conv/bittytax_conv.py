@@ -19,6 +19,7 @@ from .datafile import DataFile
 from .datamerge import DataMerge
 from .output_csv import OutputCsv
 from .output_excel import OutputExcel
+from ..price.exceptions import PricesNotCachedError
 from .exceptions import UnknownCryptoassetError, UnknownUsernameError, DataFilenameError, \
                         DataFormatUnrecognised
 
@@ -47,6 +48,10 @@ def main():
                         '--debug',
                         action='store_true',
                         help="enable debug logging")
+    parser.add_argument('--offline',
+                        action='store_true',
+                        help="only use prices which have already been cached, nothing is "
+                             "downloaded")
     parser.add_argument('-uc',
                         '--unconfirmed',
                         action='store_true',
@@ -83,6 +88,7 @@ def main():
 
     args = parser.parse_args()
     config.debug = args.debug
+    config.offline = args.offline
     DataFile.remove_duplicates = args.duplicates
 
     if config.debug:
@@ -123,6 +129,12 @@ def main():
                     sys.stderr.write("%sWARNING%s File could not be read: %s\n" % (
                         Back.YELLOW+Fore.BLACK, Back.RESET+Fore.YELLOW, pathname))
 
+    if DataParser.price_misses:
+        sys.stderr.write(Fore.RESET)
+        parser.exit("%s: error: %s" % (
+            parser.prog, PricesNotCachedError(DataParser.price_misses,
+                                              DataParser.asset_list_misses)))
+
     if DataFile.data_files:
         DataMerge.match_merge(DataFile.data_files)
 
@@ -11,6 +11,7 @@ import dateutil.tz
 
 from ..config import config
 from ..price.pricedata import PriceData
+from ..price.exceptions import DataSourceOfflineError, AssetListOfflineError
 
 TERM_WIDTH = 69
 
@@ -26,7 +27,11 @@ class DataParser(object):
     LIST_ORDER = (TYPE_WALLET, TYPE_EXCHANGE, TYPE_SAVINGS, TYPE_EXPLORER, TYPE_ACCOUNTING,
                   TYPE_SHARES)
 
-    price_data = PriceData(config.data_source_fiat)
+    # Only created when the first currency conversion is needed
+    price_data = None
+    # Prices which are not cached when offline, reported together once all files are read
+    price_misses = []
+    asset_list_misses = []
     parsers = []
 
     def __init__(self, p_type, name, header, delimiter=',',
@@ -98,10 +103,29 @@ class DataParser(object):
         if config.ccy == from_currency:
             return Decimal(value)
 
-        if timestamp.date() >= datetime.now().date():
-            rate_ccy, _, _ = cls.price_data.get_latest(from_currency, config.ccy)
-        else:
-            rate_ccy, _, _, _ = cls.price_data.get_historical(from_currency, config.ccy, timestamp)
+        if DataParser.price_data is None:
+            DataParser.price_data = PriceData(config.data_source_fiat)
+
+        try:
+            if timestamp.date() >= datetime.now().date():
+                rate_ccy, _, _ = cls.price_data.get_latest(from_currency, config.ccy)
+            else:
+                rate_ccy, _, _, _ = cls.price_data.get_historical(from_currency, config.ccy,
+                                                                  timestamp)
+        except AssetListOfflineError as e:
+            miss = "Price for %s/%s on %s (%s)" % (from_currency, config.ccy,
+                                                   timestamp.strftime('%Y-%m-%d'), e.data_source)
+            if miss not in DataParser.price_misses:
+                DataParser.price_misses.append(miss)
+            if e.data_source not in DataParser.asset_list_misses:
+                DataParser.asset_list_misses.append(e.data_source)
+            return Decimal(0)
+        except DataSourceOfflineError as e:
+            miss = "%s (%s)" % (e.value, e.data_source)
+            if miss not in DataParser.price_misses:
+                DataParser.price_misses.append(miss)
+            # Parsers do arithmetic on the value, it's never output as the misses are fatal
+            return Decimal(0)
 
         value_in_ccy = Decimal(value) * rate_ccy
 
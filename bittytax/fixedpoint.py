@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+# (c) Nano Nano Ltd 2022
+
+import copy
+from decimal import Decimal, Context, ROUND_HALF_EVEN
+
+from .holdings import Holdings
+from .transactions import Buy
+
+# Wide enough that scaling a Decimal to/from an integer is always exact
+CONTEXT = Context(prec=100)
+
+# The C implementation of decimal (Python 3.3+) outruns integer arithmetic done in Python
+#  (the pure Python version also sets __libmpdec_version__, but its methods have code objects)
+C_DECIMAL = not hasattr(Decimal.__add__, '__code__')
+
+class Disposal(object):
+    # Only what a tax event needs from a sell, converted back to Decimal
+    __slots__ = ('timestamp', 'asset', 'quantity', 'proceeds')
+
+    def __init__(self, timestamp, asset, quantity, proceeds):
+        self.timestamp = timestamp
+        self.asset = asset
+        self.quantity = quantity
+        self.proceeds = proceeds
+
+class FixedPoint(object):
+    # Fiat values keep more decimal places than were input, so costs and fees which are
+    #  apportioned by a split or the section 104 pool still round to the same pennies
+    VALUE_GUARD_PLACES = 8
+    VALUE_MAX_PLACES = 18
+
+    def __init__(self, transactions):
+        self.quantity_places = {}
+        self.value_places = {}
+
+        for t in transactions:
+            if t.asset not in self.quantity_places:
+                self.quantity_places[t.asset] = 0
+                self.value_places[t.asset] = 2
+
+            self.quantity_places[t.asset] = max(self.quantity_places[t.asset],
+                                                self._places(t.quantity))
+
+            for value in (self._value(t), t.fee_value):
+                if value is not None:
+                    self.value_places[t.asset] = max(self.value_places[t.asset],
+                                                     self._places(value))
+
+        self.quantity_scales = {}
+        self.value_scales = {}
+        self.penny_units = {}
+        for asset in self.value_places:
+            self.value_places[asset] = min(self.value_places[asset] + self.VALUE_GUARD_PLACES,
+                                           self.VALUE_MAX_PLACES)
+            self.quantity_scales[asset] = Decimal(1).scaleb(self.quantity_places[asset])
+            self.value_scales[asset] = Decimal(1).scaleb(self.value_places[asset])
+            self.penny_units[asset] = 10 ** (self.value_places[asset] - 2)
+
+    @staticmethod
+    def _value(t):
+        # Cost of a buy, or proceeds of a sell
+        return t.cost if hasattr(t, 'cost') else t.proceeds
+
+    @staticmethod
+    def _places(value):
+        return max(0, -value.as_tuple().exponent)
+
+    @staticmethod
+    def _to_fixed(value, scale):
+        # Multiplying by a power of ten only changes the exponent, so it's exact
+        return int((value * scale).to_integral_value(ROUND_HALF_EVEN))
+
+    @staticmethod
+    def _to_decimal(value, places):
+        return Decimal(value).scaleb(-places, CONTEXT)
+
+    def convert(self, transactions):
+        # Only called for copies, the transactions themselves stay in Decimal
+        for t in transactions:
+            # Quantity places are never fewer than the quantity has, so no rounding is needed
+            t.quantity = int(t.quantity * self.quantity_scales[t.asset])
+            scale = self.value_scales[t.asset]
+
+            if t.fee_value is not None:
+                t.fee_value = self._to_fixed(t.fee_value, scale)
+
+            # Deposits and withdrawals have no cost or proceeds
+            if isinstance(t, Buy):
+                if t.cost is not None:
+                    t.cost = self._to_fixed(t.cost, scale)
+            elif t.proceeds is not None:
+                t.proceeds = self._to_fixed(t.proceeds, scale)
+
+    @staticmethod
+    def apportion(value, part, whole):
+        # Share of a value given by part/whole, integer division rounded half up
+        return (2 * value * part + whole) // (2 * whole)
+
+    def split_buy(self, b, sell_quantity):
+        # Same as Buy.split_buy, using integer arithmetic
+        remainder = copy.copy(b)
+
+        b.cost = self.apportion(b.cost, sell_quantity, b.quantity)
+
+        if b.fee_value:
+            b.fee_value = self.apportion(b.fee_value, sell_quantity, b.quantity)
+
+        b.quantity = sell_quantity
+        b.set_tid()
+
+        remainder.cost = remainder.cost - b.cost
+
+        if b.fee_value:
+            remainder.fee_value = remainder.fee_value - b.fee_value
+
+        remainder.quantity = remainder.quantity - sell_quantity
+        remainder.set_tid()
+        return remainder
+
+    def split_sell(self, s, buy_quantity):
+        # Same as Sell.split_sell, using integer arithmetic
+        remainder = copy.copy(s)
+
+        s.proceeds = self.apportion(s.proceeds, buy_quantity, s.quantity)
+
+        if s.fee_value:
+            s.fee_value = self.apportion(s.fee_value, buy_quantity, s.quantity)
+
+        s.quantity = buy_quantity
+        s.set_tid()
+
+        remainder.proceeds = remainder.proceeds - s.proceeds
+
+        if s.fee_value:
+            remainder.fee_value = remainder.fee_value - s.fee_value
+
+        remainder.quantity = remainder.quantity - buy_quantity
+        remainder.set_tid()
+        return remainder
+
+    def quantize(self, value, asset):
+        # Equivalent to Decimal.quantize(PRECISION)
+        unit = self.penny_units[asset]
+        quotient, remainder = divmod(value, unit)
+        if 2 * remainder > unit or (2 * remainder == unit and quotient % 2):
+            quotient += 1
+
+        return quotient * unit
+
+    def holdings(self, asset):
+        holdings = Holdings(asset)
+        holdings.quantity = holdings.cost = holdings.fees = 0
+        return holdings
+
+    def disposal(self, s, cost, fees):
+        # Tax events are reported in Decimal, the sell itself is left as it is
+        places = self.value_places[s.asset]
+        return (Disposal(s.timestamp, s.asset,
+                         self._to_decimal(s.quantity, self.quantity_places[s.asset]),
+                         self._to_decimal(s.proceeds, places)),
+                self._to_decimal(cost, places),
+                self._to_decimal(fees, places))
+
+    def to_decimal_holdings(self, holdings):
+        for h in holdings.values():
+            places = self.value_places[h.asset]
+            h.quantity = self._to_decimal(h.quantity, self.quantity_places[h.asset])
+            h.cost = self._to_decimal(h.cost, places)
+            h.fees = self._to_decimal(h.fees, places)
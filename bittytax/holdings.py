@@ -70,3 +70,8 @@ class Holdings(object):
                        "(%s:%s) for %s, cost basis will be wrong" % ( Back.RED+Fore.BLACK,
                            Back.RESET+Fore.RED, self.withdrawals, self.deposits, self.asset))
             self.mismatches += 1
+
+    def warn_transfer_mismatch(self):
+        tqdm.write("%sWARNING%s Disposal detected between a Withdrawal and a Deposit "
+                   "(%s time(s)) for %s, cost basis will be wrong" % (Back.RED+Fore.BLACK,
+                       Back.RESET+Fore.RED, self.mismatches, self.asset))
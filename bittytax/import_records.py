@@ -1,8 +1,10 @@
 # -*- coding: utf-8 -*-
 # (c) Nano Nano Ltd 2019
 
+import io
 import sys
 import csv
+import codecs
 from decimal import Decimal, InvalidOperation
 
 from colorama import Fore, Back
@@ -13,7 +15,7 @@ import xlrd
 from .config import config
 from .transactions import Buy, Sell
 from .record import TransactionRecord as TR
-from .exceptions import TransactionParserError, UnexpectedTransactionTypeError, \
+from .exceptions import ImportFailureError, TransactionParserError, UnexpectedTransactionTypeError, \
                         TimestampParserError, DataValueError, MissingDataError, \
                         UnexpectedDataError
 
@@ -143,6 +145,30 @@ class ImportRecords(object):
 
         return transaction_records
 
+def do_import(filename):
+    import_records = ImportRecords()
+
+    if filename:
+        try:
+            import_records.import_excel(filename)
+        except xlrd.XLRDError:
+            with io.open(filename, newline='', encoding='utf-8') as csv_file:
+                import_records.import_csv(csv_file)
+    else:
+        if sys.version_info[0] < 3:
+            import_records.import_csv(codecs.getreader('utf-8')(sys.stdin))
+        else:
+            import_records.import_csv(sys.stdin)
+
+    print("%simport %s (success=%s, failure=%s)" % (
+        Fore.WHITE, 'successful' if import_records.failure_cnt <= 0 else 'failure',
+        import_records.success_cnt, import_records.failure_cnt))
+
+    if import_records.failure_cnt > 0:
+        raise ImportFailureError
+
+    return import_records.get_records()
+
 class TransactionRow(object):
     HEADER = ['Type',
               'Buy Quantity', 'Buy Asset', 'Buy Value',
@@ -4,20 +4,17 @@
 import os
 
 from ..config import config
-from .datasource import DataSourceBase, BittyTaxAPI, Frankfurter
+from .datasource import DataSourceBase, DataSources, BittyTaxAPI, Frankfurter
 from .exceptions import UnexpectedDataSourceError
 
 class AssetData(object):
     FIAT_DATASOURCES = (BittyTaxAPI.__name__, Frankfurter.__name__)
 
     def __init__(self):
-        self.data_sources = {}
-
         if not os.path.exists(config.CACHE_DIR):
             os.mkdir(config.CACHE_DIR)
 
-        for data_source_class in DataSourceBase.__subclasses__():
-            self.data_sources[data_source_class.__name__.upper()] = data_source_class()
+        self.data_sources = DataSources()
 
     def get_assets(self, req_symbol, req_data_source, search_terms):
         if not req_data_source or req_data_source == 'ALL':
@@ -2,7 +2,9 @@
 # (c) Nano Nano Ltd 2019
 
 import argparse
+import io
 import sys
+import csv
 import codecs
 import platform
 import re
@@ -14,14 +16,22 @@ import dateutil.parser
 
 from ..version import __version__
 from ..config import config
+from ..import_records import ImportRecords, do_import
+from ..transactions import TransactionHistory
+from ..exceptions import ImportFailureError
 from .datasource import DataSourceBase
 from .assetdata import AssetData
-from .valueasset import ValueAsset
+from .pricedata import PriceData
+from .valueasset import ValueAsset, PriceRequests
 from .exceptions import DataSourceError
 
 CMD_LATEST = 'latest'
 CMD_HISTORY = 'historic'
 CMD_LIST = 'list'
+CMD_PREFETCH = 'prefetch'
+
+# Rows priced together from a batch, results are output after each one
+HISTORIC_BATCH_SIZE = 1000
 
 if sys.stdout.encoding != 'UTF-8':
     if sys.version_info[:2] >= (3, 7):
@@ -53,7 +63,6 @@ def main():
                                                       "'bittytax' are used." % config.ccy)
     parser_latest.add_argument('asset',
                                type=str,
-                               nargs=1,
                                help="symbol of cryptoasset or fiat currency "
                                     "(i.e. BTC/LTC/ETH or EUR/USD)")
     parser_latest.add_argument('quantity',
@@ -80,12 +89,12 @@ def main():
                                                        "'bittytax' are used." % config.ccy)
     parser_history.add_argument('asset',
                                 type=str.upper,
-                                nargs=1,
+                                nargs='?',
                                 help="symbol of cryptoasset or fiat currency "
                                      "(i.e. BTC/LTC/ETH or EUR/USD)")
     parser_history.add_argument('date',
                                 type=validate_date,
-                                nargs=1,
+                                nargs='?',
                                 help="date (YYYY-MM-DD or DD/MM/YYYY)")
     parser_history.add_argument('quantity',
                                 type=validate_quantity,
@@ -101,6 +110,15 @@ def main():
                                 '--nocache',
                                 dest='no_cache',
                                 action='store_true', help="bypass data cache")
+    parser_history.add_argument('-b',
+                                '--batch',
+                                dest='batch_filename',
+                                nargs='?',
+                                const='-',
+                                metavar='FILENAME',
+                                help="price the asset, date and quantity (optional) in each row "
+                                     "of a CSV file, or of standard input, the results are output "
+                                     "as CSV")
     parser_history.add_argument('-d',
                                 '--debug',
                                 action='store_true',
@@ -131,6 +149,22 @@ def main():
                              action='store_true',
                              help="enable debug logging")
 
+    parser_prefetch = subparsers.add_parser(CMD_PREFETCH,
+                                            help="prefetch prices for transaction records",
+                                            description="Fetch all the historic prices needed "
+                                                        "to value the transaction records in "
+                                                        "[filename], so they are cached before "
+                                                        "'bittytax' is run.")
+    parser_prefetch.add_argument('filename',
+                                 type=str,
+                                 nargs='?',
+                                 help="filename of transaction records, "
+                                      "or can read CSV data from standard input")
+    parser_prefetch.add_argument('-d',
+                                 '--debug',
+                                 action='store_true',
+                                 help="enable debug logging")
+
     args = parser.parse_args()
     config.debug = args.debug
 
@@ -140,15 +174,31 @@ def main():
         print("%ssystem: %s, release: %s" % (Fore.GREEN, platform.system(), platform.release()))
         config.output_config()
 
-    if args.command in (CMD_LATEST, CMD_HISTORY):
-        symbol = args.asset[0]
+    if args.command == CMD_HISTORY:
+        if args.batch_filename is not None:
+            if args.asset or args.date or args.quantity or args.datasource:
+                parser_history.error("argument -b/--batch: not allowed with asset, date, "
+                                     "quantity or -ds")
+        elif not args.asset or not args.date:
+            parser_history.error("the following arguments are required: asset, date")
+
+    if args.command == CMD_HISTORY and args.batch_filename is not None:
+        try:
+            do_historic_batch(args.batch_filename, args.no_cache)
+        except IOError:
+            parser.exit("%sERROR%s File could not be read: %s" % (
+                Back.RED+Fore.BLACK, Back.RESET+Fore.RED, args.batch_filename))
+        except DataSourceError as e:
+            parser.exit("%sERROR%s %s" % (Back.RED+Fore.BLACK, Back.RESET+Fore.RED, e))
+    elif args.command in (CMD_LATEST, CMD_HISTORY):
+        symbol = args.asset
         asset = price = False
 
         try:
             if args.datasource:
                 if args.command == CMD_HISTORY:
                     assets = AssetData().get_historic_price_ds(symbol,
-                                                               args.date[0],
+                                                               args.date,
                                                                args.datasource,
                                                                args.no_cache)
                 else:
@@ -163,7 +213,7 @@ def main():
                     if asset['quote'] == 'BTC':
                         if btc is None:
                             if args.command == CMD_HISTORY:
-                                btc = get_historic_btc_price(args.date[0])
+                                btc = get_historic_btc_price(args.date)
                             else:
                                 btc = get_latest_btc_price()
 
@@ -183,7 +233,7 @@ def main():
                 value_asset = ValueAsset(price_tool=True)
                 if args.command == CMD_HISTORY:
                     price_ccy, name, _ = value_asset.get_historical_price(symbol,
-                                                                          args.date[0],
+                                                                          args.date,
                                                                           args.no_cache)
                 else:
                     price_ccy, name, _ = value_asset.get_latest_price(symbol)
@@ -206,7 +256,7 @@ def main():
             if args.command == CMD_HISTORY:
                 parser.exit("%sWARNING%s Price for %s on %s is not available" % (
                     Back.YELLOW+Fore.BLACK, Back.RESET+Fore.YELLOW,
-                    symbol, args.date[0].strftime('%Y-%m-%d')))
+                    symbol, args.date.strftime('%Y-%m-%d')))
             else:
                 parser.exit("%sWARNING%s Current price for %s is not available" % (
                     Back.YELLOW+Fore.BLACK, Back.RESET+Fore.YELLOW, symbol))
@@ -225,6 +275,106 @@ def main():
             parser.exit("No results found")
 
         output_assets(assets)
+    elif args.command == CMD_PREFETCH:
+        try:
+            do_prefetch(args.filename)
+        except IOError:
+            parser.exit("%sERROR%s File could not be read: %s" % (
+                Back.RED+Fore.BLACK, Back.RESET+Fore.RED, args.filename))
+        except ImportFailureError:
+            parser.exit()
+        except DataSourceError as e:
+            parser.exit("%sERROR%s %s" % (Back.RED+Fore.BLACK, Back.RESET+Fore.RED, e))
+
+def do_prefetch(filename):
+    transaction_records = do_import(filename)
+
+    # Records are valued the same as by 'bittytax', which prefetches every price needed
+    TransactionHistory(transaction_records, ValueAsset())
+
+    print("%sprefetch successful (records=%s)" % (Fore.WHITE, len(transaction_records)))
+
+def do_historic_batch(filename, no_cache):
+    # Prices are not output as they are found, only the CSV results
+    value_asset = ValueAsset(price_tool=True,
+                             price_data=PriceData(ValueAsset.data_sources_required()))
+
+    if filename != '-':
+        with io.open(filename, newline='', encoding='utf-8') as csv_file:
+            price_rows(csv_file, value_asset, no_cache)
+    else:
+        if sys.version_info[0] < 3:
+            price_rows(codecs.getreader('utf-8')(sys.stdin), value_asset, no_cache)
+        else:
+            price_rows(sys.stdin, value_asset, no_cache)
+
+def price_rows(import_file, value_asset, no_cache):
+    if sys.version_info[0] < 3:
+        reader = csv.reader(ImportRecords.utf_8_encoder(import_file))
+    else:
+        reader = csv.reader(import_file)
+
+    writer = csv.writer(sys.stdout, lineterminator='\n')
+    writer.writerow(['Asset', 'Date', 'Quantity',
+                     'Price (%s)' % config.ccy, 'Value (%s)' % config.ccy,
+                     'Data Source', 'Name'])
+
+    rows = []
+    for row in reader:
+        if not ''.join(row).strip():
+            continue
+
+        try:
+            rows.append(parse_row(row))
+        except argparse.ArgumentTypeError as e:
+            if reader.line_num > 1:
+                sys.stderr.write("%sWARNING%s Row %s is not valid, %s: %s\n" % (
+                    Back.YELLOW+Fore.BLACK, Back.RESET+Fore.YELLOW,
+                    reader.line_num, e, ','.join(row)))
+            # otherwise it's a header, skip it
+
+        if len(rows) == HISTORIC_BATCH_SIZE:
+            output_rows(writer, value_asset, rows, no_cache)
+            rows = []
+
+    if rows:
+        output_rows(writer, value_asset, rows, no_cache)
+
+def parse_row(row):
+    if len(row) < 2 or not row[0].strip():
+        raise argparse.ArgumentTypeError("asset and date are required")
+
+    symbol = row[0].strip().upper()
+    date = validate_date(row[1].strip())
+
+    if len(row) > 2 and row[2].strip():
+        quantity = validate_quantity(row[2].strip())
+    else:
+        quantity = None
+
+    return symbol, date, quantity
+
+def output_rows(writer, value_asset, rows, no_cache):
+    if not no_cache:
+        # All the prices for these rows are fetched together
+        price_requests = PriceRequests()
+        for symbol, date, _ in rows:
+            price_requests.get_value(symbol, date, Decimal(1))
+
+        value_asset.prefetch_historical(price_requests.requests)
+
+    for symbol, date, quantity in rows:
+        price_ccy, name, data_source = value_asset.get_historical_price(symbol, date, no_cache)
+        writer.writerow([symbol,
+                         date.strftime('%Y-%m-%d'),
+                         '{:0f}'.format(quantity.normalize()) if quantity is not None else '',
+                         '{:0f}'.format(price_ccy.normalize()) if price_ccy is not None else '',
+                         '{:0f}'.format((quantity * price_ccy).normalize())
+                         if quantity is not None and price_ccy is not None else '',
+                         data_source or '',
+                         name or ''])
+
+    sys.stdout.flush()
 
 def get_latest_btc_price():
     btc = {}
@@ -4,17 +4,25 @@
 import os
 import atexit
 import json
+import functools
 import platform
+import time
+import threading
 from decimal import Decimal
 from datetime import datetime, timedelta
 
 from colorama import Fore, Back
 import dateutil.parser
 import requests
+from requests.adapters import HTTPAdapter
+from requests.compat import urlparse
 
 from ..version import __version__
 from ..config import config
-from .exceptions import UnexpectedDataSourceAssetIdError
+from .exceptions import UnexpectedDataSourceAssetIdError, DataSourceOfflineError, \
+                        AssetListOfflineError
+from .scheduler import RequestScheduler
+from .pricecache import PriceCache
 
 CRYPTOCOMPARE_MAX_DAYS = 2000
 COINPAPRIKA_MAX_DAYS = 5000
@@ -24,26 +32,46 @@ class DataSourceBase(object):
                                                   platform.python_version(),
                                                   platform.system(), platform.release())
     TIME_OUT = 30
+    MAX_CONNECTIONS = 4
+    # Sustained requests per second, and how many can be sent at once
+    RATE_LIMIT = 10
+    RATE_BURST = 10
+    # Days of prices returned by each historical request, from the date requested onwards,
+    #  None if all the prices up to today are returned
+    MAX_DAYS = 1
+    # Longest list of symbols (or ids) which can be sent in a single latest price request
+    MAX_LATEST_LENGTH = None
+
+    # Shared by all data sources, as more than one can use the same host
+    host_limits = {}
+    host_limits_lock = threading.Lock()
 
     def __init__(self):
         self.assets = {}
         self.ids = {}
-        self.prices = self.load_prices()
+        self.prices = PriceCache(self.name())
 
-        for pair in sorted(self.prices):
-            if config.debug:
-                print("%sprice: %s (%s) data cache loaded" % (Fore.YELLOW, self.name(), pair))
+        # Connections are kept open and reused, requests from different threads share the pool
+        self.session = requests.Session()
+        self.session.headers['User-Agent'] = self.USER_AGENT
+        adapter = HTTPAdapter(pool_maxsize=self.MAX_CONNECTIONS)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.scheduler = RequestScheduler(self.name(), self.RATE_LIMIT, self.RATE_BURST)
 
-        atexit.register(self.dump_prices)
+        atexit.register(self.prices.flush)
 
     def name(self):
         return self.__class__.__name__
 
     def get_json(self, url):
+        if config.offline:
+            raise DataSourceOfflineError(self.name(), url)
+
         if config.debug:
             print("%sprice: GET %s" % (Fore.YELLOW, url))
 
-        response = requests.get(url, headers={'User-Agent': self.USER_AGENT}, timeout=self.TIME_OUT)
+        response = self.scheduler.request(self._get, url)
 
         if response.status_code in [429, 502, 503, 504]:
             response.raise_for_status()
@@ -52,10 +80,123 @@ class DataSourceBase(object):
             return response.json()
         return {}
 
-    def update_prices(self, pair, prices, timestamp):
-        if pair not in self.prices:
-            self.prices[pair] = {}
+    def _get(self, url, headers=None):
+        with self.host_limit(url):
+            return self.session.get(url, headers=headers, timeout=self.TIME_OUT)
+
+    def get_asset_list(self, url):
+        # The asset list is cached, it's only requested again once it has expired, and then
+        #  only downloaded if it has changed
+        filename = os.path.join(config.CACHE_DIR, self.name() + '.assets.json')
+        cached = self.load_asset_list(filename, url)
+
+        if config.offline:
+            if not cached:
+                raise AssetListOfflineError(self.name(), "Asset list")
+            return cached['data']
+
+        if cached and time.time() - cached['timestamp'] < config.asset_list_ttl * 60 * 60:
+            if config.debug:
+                print("%sprice: %s asset list loaded from cache" % (Fore.YELLOW, self.name()))
+            return cached['data']
+
+        headers = {}
+        if cached and cached['etag']:
+            headers['If-None-Match'] = cached['etag']
+        if cached and cached['last_modified']:
+            headers['If-Modified-Since'] = cached['last_modified']
+
+        if config.debug:
+            print("%sprice: GET %s" % (Fore.YELLOW, url))
+
+        try:
+            response = self.scheduler.request(functools.partial(self._get, headers=headers),
+                                              url)
+        except requests.exceptions.RequestException:
+            if not cached:
+                raise
+            return self.stale_asset_list(cached)
+
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+
+        if response.status_code == 304 and cached:
+            if config.debug:
+                print("%sprice: %s asset list not modified" % (Fore.YELLOW, self.name()))
+            data = cached['data']
+            # A 304 doesn't have to send the validators again
+            etag = etag or cached['etag']
+            last_modified = last_modified or cached['last_modified']
+        elif response:
+            data = response.json()
+        elif cached:
+            return self.stale_asset_list(cached)
+        else:
+            if response.status_code in [429, 502, 503, 504]:
+                response.raise_for_status()
+            return {}
+
+        self.dump_asset_list(filename, {'url': url,
+                                        'timestamp': time.time(),
+                                        'etag': etag,
+                                        'last_modified': last_modified,
+                                        'data': data})
+        return data
+
+    def stale_asset_list(self, cached):
+        # The expired list is still better than none, it's requested again on the next run
+        print("%sWARNING%s Asset list for %s could not be updated, the cached list is used" % (
+            Back.YELLOW+Fore.BLACK, Back.RESET+Fore.YELLOW, self.name()))
+        return cached['data']
+
+    def load_asset_list(self, filename, url):
+        if not os.path.exists(filename):
+            return None
+
+        try:
+            with open(filename, 'r') as asset_cache:
+                cached = json.load(asset_cache)
+        except (IOError, ValueError):
+            print("%sWARNING%s Asset list cached for %s could not be loaded" % (
+                Back.YELLOW+Fore.BLACK, Back.RESET+Fore.YELLOW, self.name()))
+            return None
+
+        if cached.get('url') != url:
+            return None
+        return cached
+
+    @staticmethod
+    def dump_asset_list(filename, cached):
+        with open(filename, 'w') as asset_cache:
+            json.dump(cached, asset_cache)
+
+    def host_limit(self, url):
+        # Limits the number of concurrent requests to each host
+        host = urlparse(url).netloc
+
+        with self.host_limits_lock:
+            if host not in self.host_limits:
+                self.host_limits[host] = threading.BoundedSemaphore(self.MAX_CONNECTIONS)
+
+            return self.host_limits[host]
 
+    def get_latest_batch(self, assets, quote):
+        # Data sources without a multiple asset endpoint fetch the latest price of each in turn
+        return {asset: self.get_latest(asset, quote) for asset in assets}
+
+    def batches(self, symbols):
+        # Splits symbols into comma separated lists, none longer than allowed in a request
+        batch = []
+        for symbol in symbols:
+            if batch and len(','.join(batch + [symbol])) > self.MAX_LATEST_LENGTH:
+                yield batch
+                batch = []
+            batch.append(symbol)
+
+        if batch:
+            yield batch
+
+    def update_prices(self, pair, prices, timestamp):
         # We are not interested in today's latest price, only the days closing price, also need to
         #  filter any erroneous future dates returned
         prices = {k: v
@@ -69,32 +210,43 @@ class DataSourceBase(object):
             prices[date] = {'price': None,
                             'url': None}
 
-        self.prices[pair].update(prices)
-
-    def load_prices(self):
-        filename = os.path.join(config.CACHE_DIR, self.name() + '.json')
-        if not os.path.exists(filename):
-            return {}
-
-        try:
-            with open(filename, 'r') as price_cache:
-                json_prices = json.load(price_cache)
-                return {pair: {date: {'price': self.str_to_decimal(price['price']),
-                                      'url': price['url']}
-                               for date, price in json_prices[pair].items()}
-                        for pair in json_prices}
-        except:
-            print("%sWARNING%s Data cached for %s could not be loaded" % (
-                Back.YELLOW+Fore.BLACK, Back.RESET+Fore.YELLOW, self.name()))
-            return {}
+        self.prices.update(pair, prices)
 
-    def dump_prices(self):
-        with open(os.path.join(config.CACHE_DIR, self.name() + '.json'), 'w') as price_cache:
-            json_prices = {pair: {date: {'price': self.decimal_to_str(price['price']),
-                                         'url': price['url']}
-                                  for date, price in self.prices[pair].items()}
-                           for pair in self.prices}
-            json.dump(json_prices, price_cache, indent=4, sort_keys=True)
+    def get_historical_range(self, asset, quote, timestamps):
+        # The dates missing from the cache are covered by the fewest requests, each one starts
+        #  from the earliest date not covered by the one before
+        pair = self.pair(asset, quote)
+        window_end = datetime.min.date()
+        windows = []
+
+        for timestamp in sorted(timestamps):
+            if timestamp.date() < window_end:
+                continue
+
+            if pair in self.prices and timestamp.strftime('%Y-%m-%d') in self.prices[pair]:
+                continue
+
+            self.get_historical(asset, quote, timestamp)
+
+            if self.MAX_DAYS is None:
+                window_end = datetime.max.date()
+            else:
+                window_end = timestamp.date() + timedelta(days=self.MAX_DAYS)
+
+            # update_prices always caches the date requested, so if it's still missing the
+            #  response wasn't parsed (i.e. an error), and the window can't be relied upon
+            if pair in self.prices and timestamp.strftime('%Y-%m-%d') in self.prices[pair]:
+                windows.append((timestamp.date(), window_end))
+
+        if windows:
+            # Dates which were covered but not returned, set to None to prevent repeat lookups
+            self.prices.update(pair, {timestamp.strftime('%Y-%m-%d'): {'price': None,
+                                                                       'url': None}
+                                      for timestamp in timestamps
+                                      if timestamp.strftime('%Y-%m-%d') not in self.prices[pair]
+                                      and timestamp.date() < datetime.now().date()
+                                      and any(start <= timestamp.date() < end
+                                              for start, end in windows)})
 
     def get_config_assets(self):
         for symbol in config.data_source_select:
@@ -159,20 +311,6 @@ class DataSourceBase(object):
     def pair(asset, quote):
         return asset + '/' + quote
 
-    @staticmethod
-    def str_to_decimal(price):
-        if price:
-            return Decimal(price)
-
-        return None
-
-    @staticmethod
-    def decimal_to_str(price):
-        if price:
-            return '{0:f}'.format(price)
-
-        return None
-
     @staticmethod
     def epoch_time(timestamp):
         epoch = (timestamp - datetime(1970, 1, 1, tzinfo=config.TZ_UTC)).total_seconds()
@@ -181,7 +319,7 @@ class DataSourceBase(object):
 class BittyTaxAPI(DataSourceBase):
     def __init__(self):
         super(BittyTaxAPI, self).__init__()
-        json_resp = self.get_json("https://api.bitty.tax/v1/symbols")
+        json_resp = self.get_asset_list("https://api.bitty.tax/v1/symbols")
         self.assets = {k: {'name': v}
                        for k, v in json_resp['symbols'].items()}
 
@@ -238,6 +376,8 @@ class Frankfurter(DataSourceBase):
                            timestamp)
 
 class CoinDesk(DataSourceBase):
+    MAX_DAYS = None
+
     def __init__(self):
         super(CoinDesk, self).__init__()
         self.assets = {'BTC': {'name': 'Bitcoin'}}
@@ -261,9 +401,13 @@ class CoinDesk(DataSourceBase):
                                timestamp)
 
 class CryptoCompare(DataSourceBase):
+    RATE_LIMIT = 5
+    MAX_DAYS = CRYPTOCOMPARE_MAX_DAYS
+    MAX_LATEST_LENGTH = 300
+
     def __init__(self):
         super(CryptoCompare, self).__init__()
-        json_resp = self.get_json("https://min-api.cryptocompare.com/data/all/coinlist")
+        json_resp = self.get_asset_list("https://min-api.cryptocompare.com/data/all/coinlist")
         self.assets = {c[1]['Symbol'].strip().upper(): {'name': c[1]['CoinName'].strip()}
                        for c in json_resp['Data'].items()}
         # CryptoCompare symbols are unique, so no ID required
@@ -273,6 +417,16 @@ class CryptoCompare(DataSourceBase):
             "?extraParams=%s&fsym=%s&tsyms=%s" % (self.USER_AGENT, asset, quote))
         return Decimal(repr(json_resp[quote])) if quote in json_resp else None
 
+    def get_latest_batch(self, assets, quote):
+        latest = {}
+        for batch in self.batches(assets):
+            json_resp = self.get_json("https://min-api.cryptocompare.com/data/pricemulti" \
+                "?extraParams=%s&fsyms=%s&tsyms=%s" % (self.USER_AGENT, ','.join(batch), quote))
+            for asset in batch:
+                latest[asset] = Decimal(repr(json_resp[asset][quote])) \
+                        if asset in json_resp and quote in json_resp[asset] else None
+        return latest
+
     def get_historical(self, asset, quote, timestamp, _asset_id=None):
         url = "https://min-api.cryptocompare.com/data/histoday?aggregate=1&extraParams=%s" \
               "&fsym=%s&tsym=%s&limit=%s&toTs=%d" % (
@@ -291,9 +445,15 @@ class CryptoCompare(DataSourceBase):
                                timestamp)
 
 class CoinGecko(DataSourceBase):
+    # Public API allows less than 30 calls per minute
+    RATE_LIMIT = 0.4
+    RATE_BURST = 5
+    MAX_DAYS = None
+    MAX_LATEST_LENGTH = 2000
+
     def __init__(self):
         super(CoinGecko, self).__init__()
-        json_resp = self.get_json("https://api.coingecko.com/api/v3/coins/list")
+        json_resp = self.get_asset_list("https://api.coingecko.com/api/v3/coins/list")
         self.ids = {c['id']: {'symbol': c['symbol'].strip().upper(), 'name': c['name'].strip()}
                     for c in json_resp}
         self.assets = {c['symbol'].strip().upper(): {'id': c['id'], 'name': c['name'].strip()}
@@ -310,6 +470,17 @@ class CoinGecko(DataSourceBase):
                 if 'market_data' in json_resp and 'current_price' in json_resp['market_data'] and \
                 quote.lower() in json_resp['market_data']['current_price'] else None
 
+    def get_latest_batch(self, assets, quote):
+        asset_ids = {asset: self.assets[asset]['id'] for asset in assets}
+        latest = {}
+        for batch in self.batches(sorted(set(asset_ids.values()))):
+            json_resp = self.get_json("https://api.coingecko.com/api/v3/simple/price?ids=%s" \
+                "&vs_currencies=%s" % (','.join(batch), quote.lower()))
+            latest.update({asset_id: Decimal(repr(json_resp[asset_id][quote.lower()]))
+                           for asset_id in batch
+                           if asset_id in json_resp and quote.lower() in json_resp[asset_id]})
+        return {asset: latest.get(asset_ids[asset]) for asset in assets}
+
     def get_historical(self, asset, quote, timestamp, asset_id=None):
         if asset_id is None:
             asset_id = self.assets[asset]['id']
@@ -326,9 +497,11 @@ class CoinGecko(DataSourceBase):
                                timestamp)
 
 class CoinPaprika(DataSourceBase):
+    MAX_DAYS = COINPAPRIKA_MAX_DAYS
+
     def __init__(self):
         super(CoinPaprika, self).__init__()
-        json_resp = self.get_json("https://api.coinpaprika.com/v1/coins")
+        json_resp = self.get_asset_list("https://api.coinpaprika.com/v1/coins")
         self.ids = {c['id']: {'symbol': c['symbol'].strip().upper(), 'name': c['name'].strip()}
                     for c in json_resp}
         self.assets = {c['symbol'].strip().upper(): {'id': c['id'], 'name': c['name'].strip()}
@@ -363,3 +536,33 @@ class CoinPaprika(DataSourceBase):
                                'price': Decimal(repr(p['price'])) if p['price'] else None,
                                'url': url} for p in json_resp},
                            timestamp)
+
+class DataSources(object):
+    # Each data source is only created when it's first used, so one which isn't needed never
+    #  loads its asset list
+    def __init__(self, names=None):
+        if names is not None:
+            names = [name.upper() for name in names]
+
+        self.classes = {data_source_class.__name__.upper(): data_source_class
+                        for data_source_class in DataSourceBase.__subclasses__()
+                        if names is None or data_source_class.__name__.upper() in names}
+        self.locks = {name: threading.Lock() for name in self.classes}
+        self.loaded = {}
+
+    def __contains__(self, name):
+        return name in self.classes
+
+    def __iter__(self):
+        return iter(self.classes)
+
+    def __len__(self):
+        return len(self.classes)
+
+    def __getitem__(self, name):
+        if name not in self.loaded:
+            with self.locks[name]:
+                if name not in self.loaded:
+                    self.loaded[name] = self.classes[name]()
+
+        return self.loaded[name]
@@ -24,3 +24,27 @@ class UnexpectedDataSourceAssetIdError(DataSourceError):
             self.data_source,
             self.value,
             os.path.join(config.BITTYTAX_PATH, config.BITTYTAX_CONFIG))
+
+class DataSourceOfflineError(DataSourceError):
+    def __str__(self):
+        return "%s is not cached for %s, and can't be downloaded offline" % (
+            self.value,
+            self.data_source)
+
+class AssetListOfflineError(DataSourceOfflineError):
+    pass
+
+class PricesNotCachedError(DataSourceError):
+    def __init__(self, prices, asset_lists=None):
+        super(PricesNotCachedError, self).__init__(None, prices)
+        self.asset_lists = asset_lists or []
+
+    def __str__(self):
+        msg = "%d price(s) are not cached, and can't be downloaded offline:\n  %s" % (
+            len(self.value),
+            '\n  '.join(self.value))
+
+        if self.asset_lists:
+            msg += "\n%d asset list(s) are not cached, so the prices above can't be looked " \
+                   "up:\n  %s" % (len(self.asset_lists), '\n  '.join(self.asset_lists))
+        return msg
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+# (c) Nano Nano Ltd 2022
+
+import os
+import json
+import sqlite3
+import threading
+from decimal import Decimal
+
+from colorama import Fore, Back
+
+from ..config import config
+
+class PriceCache(object):
+    # Prices are stored in SQLite, indexed by pair and date. Each pair is only read when it's
+    #  first used, and only the rows which are new or have changed are written back
+    def __init__(self, name):
+        self.name = name
+        self.prices = {}
+        self.dirty = {}
+        self.lock = threading.RLock()
+        self._connection = None
+
+    @property
+    def connection(self):
+        # Not opened until it's needed, a data source which is never used has no I/O
+        with self.lock:
+            if self._connection is None:
+                filename = os.path.join(config.CACHE_DIR, self.name + '.db')
+                try:
+                    self._connection = self.connect(filename)
+                except sqlite3.Error:
+                    print("%sWARNING%s Data cached for %s could not be loaded" % (
+                        Back.YELLOW+Fore.BLACK, Back.RESET+Fore.YELLOW, self.name))
+                    self._connection = self.connect(':memory:')
+                else:
+                    json_filename = os.path.join(config.CACHE_DIR, self.name + '.json')
+                    if os.path.exists(json_filename):
+                        self.migrate(json_filename)
+
+            return self._connection
+
+    @staticmethod
+    def connect(filename):
+        # Connection is shared by the threads fetching prices, access is serialised by the lock
+        connection = sqlite3.connect(filename, check_same_thread=False)
+        connection.execute("CREATE TABLE IF NOT EXISTS prices ("
+                           "pair TEXT NOT NULL, "
+                           "date TEXT NOT NULL, "
+                           "price TEXT, "
+                           "url TEXT, "
+                           "PRIMARY KEY (pair, date))")
+        return connection
+
+    def migrate(self, json_filename):
+        # Prices from the old JSON cache are copied over once, then the file is renamed
+        try:
+            with open(json_filename, 'r') as price_cache:
+                json_prices = json.load(price_cache)
+
+            with self.connection:
+                self.connection.executemany("INSERT OR IGNORE INTO prices VALUES (?, ?, ?, ?)",
+                                            ((pair, date, price['price'] or None, price['url'])
+                                             for pair in json_prices
+                                             for date, price in json_prices[pair].items()))
+        except (ValueError, KeyError, TypeError, AttributeError, sqlite3.Error):
+            print("%sWARNING%s Data cached for %s could not be migrated: %s" % (
+                Back.YELLOW+Fore.BLACK, Back.RESET+Fore.YELLOW, self.name, json_filename))
+            return
+
+        if os.path.exists(json_filename + '.bak'):
+            os.remove(json_filename + '.bak')
+        os.rename(json_filename, json_filename + '.bak')
+
+        if config.debug:
+            print("%sprice: %s data cache migrated from %s" % (
+                Fore.YELLOW, self.name, json_filename))
+
+    def load(self, pair):
+        with self.lock:
+            if pair not in self.prices:
+                self.prices[pair] = {date: {'price': self.str_to_decimal(price),
+                                            'url': url}
+                                     for date, price, url in self.connection.execute(
+                                         "SELECT date, price, url FROM prices WHERE pair = ?",
+                                         (pair,))}
+
+                if self.prices[pair] and config.debug:
+                    print("%sprice: %s (%s) data cache loaded" % (Fore.YELLOW, self.name, pair))
+
+            return self.prices[pair]
+
+    def __contains__(self, pair):
+        return bool(self.load(pair))
+
+    def __getitem__(self, pair):
+        return self.load(pair)
+
+    def get(self, pair, default=None):
+        return self.load(pair) or default
+
+    def update(self, pair, prices):
+        with self.lock:
+            cached = self.load(pair)
+            for date, price in prices.items():
+                if cached.get(date) != price:
+                    cached[date] = price
+
+                    if pair not in self.dirty:
+                        self.dirty[pair] = set()
+                    self.dirty[pair].add(date)
+
+    def flush(self):
+        # Only pairs which have been modified are written, all in a single transaction, so
+        #  a crash part way through leaves the cache as it was
+        with self.lock:
+            if not self.dirty:
+                return
+
+            try:
+                with self.connection:
+                    self.connection.executemany(
+                        "INSERT OR REPLACE INTO prices VALUES (?, ?, ?, ?)",
+                        [(pair, date, self.decimal_to_str(self.prices[pair][date]['price']),
+                          self.prices[pair][date]['url'])
+                         for pair in sorted(self.dirty) for date in sorted(self.dirty[pair])])
+            except sqlite3.Error:
+                print("%sWARNING%s Data cached for %s could not be saved" % (
+                    Back.YELLOW+Fore.BLACK, Back.RESET+Fore.YELLOW, self.name))
+                return
+
+            if config.debug:
+                print("%sprice: %s data cache saved (%s)" % (
+                    Fore.YELLOW, self.name, ', '.join(sorted(self.dirty))))
+
+            self.dirty = {}
+
+    @staticmethod
+    def str_to_decimal(price):
+        if price:
+            return Decimal(price)
+
+        return None
+
+    @staticmethod
+    def decimal_to_str(price):
+        if price:
+            return '{0:f}'.format(price)
+
+        return None
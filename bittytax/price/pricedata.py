@@ -7,20 +7,19 @@ from colorama import Fore
 
 from ..version import __version__
 from ..config import config
-from .datasource import DataSourceBase
-from .exceptions import UnexpectedDataSourceError
+from .datasource import DataSourceBase, DataSources
+from .exceptions import UnexpectedDataSourceError, DataSourceOfflineError
 
 class PriceData(object):
     def __init__(self, data_sources_required, price_tool=False):
         self.price_tool = price_tool
-        self.data_sources = {}
+        # Latest prices are only fetched once per run, by asset and quote
+        self.latest = {}
 
         if not os.path.exists(config.CACHE_DIR):
             os.mkdir(config.CACHE_DIR)
 
-        for data_source_class in DataSourceBase.__subclasses__():
-            if data_source_class.__name__.upper() in [ds.upper() for ds in data_sources_required]:
-                self.data_sources[data_source_class.__name__.upper()] = data_source_class()
+        self.data_sources = DataSources(data_sources_required)
 
     @staticmethod
     def data_source_priority(asset):
@@ -33,6 +32,10 @@ class PriceData(object):
     def get_latest_ds(self, data_source, asset, quote):
         if data_source.upper() in self.data_sources:
             if asset in self.data_sources[data_source.upper()].assets:
+                if config.offline:
+                    raise DataSourceOfflineError(self.data_sources[data_source.upper()].name(),
+                                                 "Latest price for %s/%s" % (asset, quote))
+
                 return self.data_sources[data_source.upper()].get_latest(asset, quote), \
                        self.data_sources[data_source.upper()].assets[asset]['name']
 
@@ -53,6 +56,10 @@ class PriceData(object):
                               self.data_sources[data_source.upper()].assets[asset]['name'], \
                               self.data_sources[data_source.upper()].prices[pair][date]['url']
 
+                if config.offline:
+                    raise DataSourceOfflineError(self.data_sources[data_source.upper()].name(),
+                                                 "Price for %s on %s" % (pair, date))
+
                 self.data_sources[data_source.upper()].get_historical(asset, quote, timestamp)
                 if pair in self.data_sources[data_source.upper()].prices and \
                    date in self.data_sources[data_source.upper()].prices[pair]:
@@ -63,28 +70,89 @@ class PriceData(object):
             return None, None, None
         raise UnexpectedDataSourceError(data_source, DataSourceBase)
 
+    def get_historical_range(self, asset, quote, timestamps):
+        # Prices are fetched into the cache of each data source in turn, same as get_historical,
+        #  the next data source is only used for the dates the previous one has no price for
+        for data_source in self.data_source_priority(asset):
+            if not timestamps:
+                break
+
+            if data_source.upper() not in self.data_sources:
+                raise UnexpectedDataSourceError(data_source, DataSourceBase)
+
+            if asset in self.data_sources[data_source.upper()].assets:
+                self.data_sources[data_source.upper()].get_historical_range(asset, quote,
+                                                                            timestamps)
+                pair = asset + '/' + quote
+                prices = self.data_sources[data_source.upper()].prices.get(pair, {})
+                timestamps = [timestamp for timestamp in timestamps
+                              if prices.get(timestamp.strftime('%Y-%m-%d'),
+                                            {}).get('price') is None]
+
+    def get_latest_batch(self, assets, quote):
+        # Each asset follows its own data source priority, the assets which have got to the
+        #  same data source are fetched together
+        pending = {asset: list(self.data_source_priority(asset))
+                   for asset in assets if (asset, quote) not in self.latest}
+        names = {}
+
+        while pending:
+            batches = {}
+            for asset in sorted(pending):
+                if not pending[asset]:
+                    self.latest[(asset, quote)] = (None, names.get(asset), None)
+                    del pending[asset]
+                    continue
+
+                data_source = pending[asset].pop(0)
+                if data_source.upper() not in self.data_sources:
+                    raise UnexpectedDataSourceError(data_source, DataSourceBase)
+
+                if asset in self.data_sources[data_source.upper()].assets:
+                    if data_source.upper() not in batches:
+                        batches[data_source.upper()] = []
+                    batches[data_source.upper()].append(asset)
+
+            for data_source in batches:
+                prices = self.data_sources[data_source].get_latest_batch(batches[data_source],
+                                                                         quote)
+                for asset in batches[data_source]:
+                    names[asset] = self.data_sources[data_source].assets[asset]['name']
+                    if prices.get(asset) is not None:
+                        self.latest[(asset, quote)] = (prices[asset], names[asset],
+                                                       self.data_sources[data_source].name())
+                        del pending[asset]
+
     def get_latest(self, asset, quote):
+        if (asset, quote) not in self.latest:
+            self.latest[(asset, quote)] = self._get_latest(asset, quote)
+
+        price, name, data_source = self.latest[(asset, quote)]
+        if price is not None:
+            if config.debug:
+                print("%sprice: <latest>, 1 %s=%s %s via %s (%s)" % (
+                    Fore.YELLOW,
+                    asset,
+                    '{:0,f}'.format(price.normalize()),
+                    quote,
+                    data_source,
+                    name))
+            if self.price_tool:
+                print("%s1 %s=%s %s %svia %s (%s)" % (
+                    Fore.YELLOW,
+                    asset,
+                    '{:0,f}'.format(price.normalize()),
+                    quote,
+                    Fore.CYAN,
+                    data_source,
+                    name))
+        return price, name, data_source
+
+    def _get_latest(self, asset, quote):
         name = None
         for data_source in self.data_source_priority(asset):
             price, name = self.get_latest_ds(data_source, asset, quote)
             if price is not None:
-                if config.debug:
-                    print("%sprice: <latest>, 1 %s=%s %s via %s (%s)" % (
-                        Fore.YELLOW,
-                        asset,
-                        '{:0,f}'.format(price.normalize()),
-                        quote,
-                        self.data_sources[data_source.upper()].name(),
-                        name))
-                if self.price_tool:
-                    print("%s1 %s=%s %s %svia %s (%s)" % (
-                        Fore.YELLOW,
-                        asset,
-                        '{:0,f}'.format(price.normalize()),
-                        quote,
-                        Fore.CYAN,
-                        self.data_sources[data_source.upper()].name(),
-                        name))
                 return price, name, self.data_sources[data_source.upper()].name()
         return None, name, None
 
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+# (c) Nano Nano Ltd 2022
+
+import time
+import random
+import threading
+from email.utils import parsedate_tz, mktime_tz
+
+from colorama import Fore
+
+from ..config import config
+
+class TokenBucket(object):
+    def __init__(self, rate, burst):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.tokens = self.burst
+        self.updated = time.time()
+        # No tokens are available before this time
+        self.not_before = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        # Blocks until a token is available, returns the time waited
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.time()
+                if now < self.not_before:
+                    wait = self.not_before - now
+                else:
+                    self.tokens = min(self.burst,
+                                      self.tokens + (now - self.updated) * self.rate)
+                    self.updated = now
+
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return waited
+
+                    wait = (1 - self.tokens) / self.rate
+
+            time.sleep(wait)
+            waited += wait
+
+    def pause(self, delay):
+        # Server has asked us to slow down, no tokens are available until the delay has passed.
+        #  Pauses asked for by concurrent requests overlap, they don't add up
+        with self.lock:
+            self.not_before = max(self.not_before, time.time() + delay)
+            # Tokens don't build up while paused, requests resume at the rate allowed
+            self.tokens = min(self.tokens, 1.0)
+            self.updated = self.not_before
+
+class RequestScheduler(object):
+    RETRY_STATUS_CODES = (429, 502, 503, 504)
+    MAX_RETRIES = 5
+    BACKOFF_BASE = 1
+    BACKOFF_MAX = 60
+
+    def __init__(self, name, rate, burst):
+        self.name = name
+        self.bucket = TokenBucket(rate, burst)
+        self.lock = threading.Lock()
+
+        self.requests = 0
+        self.retries = 0
+        self.queued = 0
+        self.max_queued = 0
+        self.wait_time = 0.0
+
+    def request(self, send, url):
+        # Requests are sent at the rate allowed, any which are rate limited or fail due to a
+        #  temporary server error are retried
+        for attempt in range(self.MAX_RETRIES + 1):
+            with self.lock:
+                self.queued += 1
+                self.max_queued = max(self.max_queued, self.queued)
+
+            waited = self.bucket.acquire()
+            with self.lock:
+                self.queued -= 1
+                self.wait_time += waited
+                self.requests += 1
+
+            response = send(url)
+
+            if response.status_code not in self.RETRY_STATUS_CODES or \
+                    attempt == self.MAX_RETRIES:
+                return response
+
+            with self.lock:
+                self.retries += 1
+
+            delay = self.retry_after(response)
+            if config.debug:
+                print("%sprice: %s HTTP %d, retry %d of %d%s (%s)" % (
+                    Fore.YELLOW, self.name, response.status_code, attempt + 1,
+                    self.MAX_RETRIES, ', after %.1fs' % delay if delay is not None else '',
+                    url))
+
+            if delay is not None:
+                # Applies to every request to this data source, not just this one
+                self.bucket.pause(delay)
+            else:
+                # Exponential backoff with full jitter
+                delay = random.uniform(0, min(self.BACKOFF_MAX, self.BACKOFF_BASE * 2 ** attempt))
+                with self.lock:
+                    self.wait_time += delay
+                time.sleep(delay)
+
+        return response
+
+    def retry_after(self, response):
+        value = response.headers.get('Retry-After')
+        if value is None:
+            return None
+
+        try:
+            delay = float(value)
+        except ValueError:
+            date = parsedate_tz(value)
+            if date is None:
+                return None
+            delay = mktime_tz(date) - time.time()
+
+        # Server's delay is always respected, only our own backoff is capped
+        return max(0.0, delay)
+
+    def report(self):
+        if config.debug:
+            print("%sprice: %s requests=%d, retries=%d, max queued=%d, waited=%.1fs" % (
+                Fore.YELLOW, self.name, self.requests, self.retries, self.max_queued,
+                self.wait_time))
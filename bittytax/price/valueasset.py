@@ -1,6 +1,9 @@
 # -*- coding: utf-8 -*-
 # (c) Nano Nano Ltd 2019
 
+import sys
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
 from decimal import Decimal
 from datetime import datetime
 
@@ -10,16 +13,28 @@ from tqdm import tqdm
 from ..version import __version__
 from ..config import config
 from .pricedata import PriceData
+from .exceptions import DataSourceOfflineError, AssetListOfflineError, PricesNotCachedError
 
 class ValueAsset(object):
-    def __init__(self, price_tool=False):
+    PREFETCH_THREADS = 8
+    MEMO_SIZE = 4096
+
+    def __init__(self, price_tool=False, price_data=None):
         self.price_tool = price_tool
         self.price_report = {}
-        data_sources_required = set(config.data_source_fiat +
-                                    config.data_source_crypto) | \
-                                {x.split(':')[0]
-                                 for v in config.data_source_select.values() for x in v}
-        self.price_data = PriceData(data_sources_required, price_tool)
+        # Most recently used prices, by asset and date
+        self.memo = OrderedDict()
+
+        if price_data:
+            # Price data (and its data sources) can be shared, the price report can't
+            self.price_data = price_data
+        else:
+            self.price_data = PriceData(self.data_sources_required(), price_tool)
+
+    @staticmethod
+    def data_sources_required():
+        return set(config.data_source_fiat + config.data_source_crypto) | \
+               {x.split(':')[0] for v in config.data_source_select.values() for x in v}
 
     def get_value(self, asset, timestamp, quantity):
         if asset == config.ccy:
@@ -59,14 +74,29 @@ class ValueAsset(object):
         return None, None, None
 
     def get_historical_price(self, asset, timestamp, no_cache=False):
-        asset_price_ccy = None
-
         if not self.price_tool and timestamp.date() >= datetime.now().date():
             tqdm.write("%sWARNING%s Price for %s on %s, no historic price available, "
                        "using latest price" % (Back.YELLOW+Fore.BLACK, Back.RESET+Fore.YELLOW,
                                                asset, timestamp.strftime('%Y-%m-%d')))
             return self.get_latest_price(asset)
 
+        if no_cache:
+            return self._get_historical_price(asset, timestamp, no_cache)
+
+        key = (asset, timestamp.date())
+        if key in self.memo:
+            price = self.memo.pop(key)
+        else:
+            price = self._get_historical_price(asset, timestamp)
+            if len(self.memo) >= self.MEMO_SIZE:
+                self.memo.popitem(last=False)
+
+        self.memo[key] = price
+        return price
+
+    def _get_historical_price(self, asset, timestamp, no_cache=False):
+        asset_price_ccy = None
+
         if asset == 'BTC' or asset in config.fiat_list:
             asset_price_ccy, name, data_source, url = self.price_data.get_historical(asset,
                                                                                      config.ccy,
@@ -79,21 +109,97 @@ class ValueAsset(object):
                                                                                      timestamp,
                                                                                      no_cache)
             if asset_price_btc is not None:
-                btc_price_ccy, name2, data_source2, url2 = self.price_data.get_historical(
-                    'BTC', config.ccy, timestamp, no_cache)
+                # BTC price is looked up the same way, so it's only resolved once for each day
+                btc_price_ccy, _, _ = self.get_historical_price('BTC', timestamp, no_cache)
                 if btc_price_ccy is not None:
                     asset_price_ccy = btc_price_ccy * asset_price_btc
 
-                self.price_report_cache('BTC', timestamp, name2, data_source2, url2, btc_price_ccy)
-
             self.price_report_cache(asset, timestamp, name, data_source, url, asset_price_ccy,
                                     asset_price_btc)
 
         return asset_price_ccy, name, data_source
 
+    def prefetch_historical(self, requests):
+        # Distinct prices needed, including the BTC price for assets which are priced in BTC
+        pairs = {}
+        for (asset, date), timestamp in requests.items():
+            if not self.price_tool and timestamp.date() >= datetime.now().date():
+                # Latest price is used instead
+                continue
+
+            if asset == 'BTC' or asset in config.fiat_list:
+                legs = [(asset, config.ccy)]
+            else:
+                legs = [(asset, 'BTC'), ('BTC', config.ccy)]
+
+            for asset_leg, quote in legs:
+                if (asset_leg, quote) not in pairs:
+                    pairs[(asset_leg, quote)] = {}
+
+                if date not in pairs[(asset_leg, quote)]:
+                    pairs[(asset_leg, quote)][date] = timestamp
+
+        if config.offline:
+            self.check_cached(pairs)
+            return
+
+        if config.debug:
+            print("%sprefetch prices" % Fore.CYAN)
+
+        # Each pair is fetched in its own thread, the data sources limit how many requests are
+        #  made to each host at once
+        pool = ThreadPool(max(1, min(self.PREFETCH_THREADS, len(pairs))))
+        try:
+            with tqdm(total=sum(len(dates) for dates in pairs.values()),
+                      unit='price',
+                      desc="%sprefetch prices%s" % (Fore.CYAN, Fore.GREEN),
+                      disable=bool(config.debug or not sys.stdout.isatty())) as progress:
+                for num_prices in pool.imap_unordered(self._prefetch_pair,
+                                                      [(asset, quote, pairs[(asset, quote)])
+                                                       for asset, quote in sorted(pairs)]):
+                    progress.update(num_prices)
+        finally:
+            pool.close()
+            pool.join()
+
+        if config.debug:
+            for data_source in sorted(self.price_data.data_sources.loaded):
+                self.price_data.data_sources.loaded[data_source].scheduler.report()
+            print("%sprefetch: total pairs=%d" % (Fore.CYAN, len(pairs)))
+
+    def check_cached(self, pairs):
+        # Nothing can be downloaded, so all the prices which are missing are reported together
+        #  before any records are valued
+        missing = []
+        asset_lists = []
+        for asset, quote in sorted(pairs):
+            for date in sorted(pairs[(asset, quote)]):
+                try:
+                    self.price_data.get_historical(asset, quote, pairs[(asset, quote)][date])
+                except AssetListOfflineError as e:
+                    # Without the asset list, the price can't be looked up in the cache either
+                    missing.append("Price for %s/%s on %s (%s)" % (asset, quote, date,
+                                                                   e.data_source))
+                    if e.data_source not in asset_lists:
+                        asset_lists.append(e.data_source)
+                except DataSourceOfflineError as e:
+                    missing.append("%s (%s)" % (e.value, e.data_source))
+
+        if missing:
+            raise PricesNotCachedError(missing, asset_lists)
+
+    def _prefetch_pair(self, args):
+        asset, quote, dates = args
+        self.price_data.get_historical_range(asset, quote, list(dates.values()))
+        return len(dates)
+
     def get_latest_price(self, asset):
         asset_price_ccy = None
 
+        if config.offline:
+            # Latest prices are never cached
+            return None, None, None
+
         if asset == 'BTC' or asset in config.fiat_list:
             asset_price_ccy, name, data_source = self.price_data.get_latest(asset, config.ccy)
         else:
@@ -106,12 +212,23 @@ class ValueAsset(object):
 
         return asset_price_ccy, name, data_source
 
+    def prefetch_latest(self, assets):
+        # The latest prices of all the assets are fetched together, with BTC (for the price of
+        #  any crypto in the local currency) fetched just once
+        if config.offline:
+            return
+
+        crypto = [asset for asset in assets if asset != 'BTC' and asset not in config.fiat_list]
+        ccy = [asset for asset in assets if asset == 'BTC' or asset in config.fiat_list]
+        if crypto and 'BTC' not in ccy:
+            ccy.append('BTC')
+
+        self.price_data.get_latest_batch(sorted(ccy), config.ccy)
+        self.price_data.get_latest_batch(sorted(crypto), 'BTC')
+
     def price_report_cache(self, asset, timestamp, name, data_source, url,
                            price_ccy, price_btc=None):
-        if timestamp > config.get_tax_year_end(timestamp.year):
-            tax_year = timestamp.year + 1
-        else:
-            tax_year = timestamp.year
+        tax_year = config.which_tax_year(timestamp)
 
         if tax_year not in self.price_report:
             self.price_report[tax_year] = {}
@@ -126,3 +243,22 @@ class ValueAsset(object):
                                                         'url': url,
                                                         'price_ccy': price_ccy,
                                                         'price_btc': price_btc}
+
+class PriceRequests(object):
+    # Stands in for ValueAsset, recording the prices which would be needed to value each asset
+    def __init__(self):
+        self.requests = {}
+
+    def get_value(self, asset, timestamp, quantity):
+        if asset == config.ccy:
+            return quantity, True
+
+        if quantity == 0:
+            return Decimal(0), False
+
+        date = timestamp.strftime('%Y-%m-%d')
+        if (asset, date) not in self.requests:
+            self.requests[(asset, date)] = timestamp
+
+        # Any non-zero value, so the same prices are requested as when actually valued
+        return quantity, False
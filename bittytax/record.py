@@ -2,6 +2,8 @@
 # (c) Nano Nano Ltd 2019
 
 import sys
+import copy
+import threading
 
 from .config import config
 
@@ -39,6 +41,10 @@ class TransactionRecord(object):
                  TYPE_TRADE)
 
     cnt = 0
+    # Clients in batch mode are imported in threads
+    cnt_lock = threading.Lock()
+
+    __slots__ = ('tid', 't_type', 'buy', 'sell', 'fee', 'wallet', 'timestamp', 'note')
 
     def __init__(self, t_type, buy, sell, fee, wallet, timestamp, note):
         self.tid = None
@@ -66,10 +72,23 @@ class TransactionRecord(object):
             self.fee.wallet = self.wallet
             self.fee.note = self.note
 
+    def __copy__(self):
+        # Buy, sell and fee are copied as well, as valuing a record changes them
+        record = TransactionRecord(self.t_type,
+                                   copy.copy(self.buy) if self.buy else None,
+                                   copy.copy(self.sell) if self.sell else None,
+                                   copy.copy(self.fee) if self.fee else None,
+                                   self.wallet,
+                                   self.timestamp,
+                                   self.note)
+        record.tid = list(self.tid) if self.tid else None
+        return record
+
     def set_tid(self):
         if self.tid is None:
-            TransactionRecord.cnt += 1
-            self.tid = [TransactionRecord.cnt, 0]
+            with TransactionRecord.cnt_lock:
+                TransactionRecord.cnt += 1
+                self.tid = [TransactionRecord.cnt, 0]
         else:
             self.tid[1] += 1
 
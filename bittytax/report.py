@@ -525,6 +525,45 @@ class ReportLog(object):
             return Fore.YELLOW + '*' + Fore.WHITE
         return '{}%'.format(rate)
 
+class ReportScenarios(object):
+    def __init__(self, results):
+        print("%sscenario report output:" % Fore.WHITE)
+        print("\n%sScenario Comparison%s" % (Fore.CYAN+Style.BRIGHT, Style.NORMAL))
+        print("%sThe figures below are only an estimate, always consult with a professional "
+              "accountant before filing." % Fore.CYAN)
+
+        header = "%-10s %9s %16s %16s %16s %16s %16s" % ('Tax Year',
+                                                       'Disposals',
+                                                       'Proceeds',
+                                                       'Allowable Costs',
+                                                       'Gain',
+                                                       'Tax (Lower)',
+                                                       'Tax (Higher)')
+        for result in results:
+            print("\n%s%s" % (Fore.CYAN, result.scenario))
+            print("%s%s" % (Fore.YELLOW, header))
+
+            for tax_year in sorted(result.tax_years):
+                tax_year_label, cgains = result.tax_years[tax_year]
+                tax_lower, tax_higher = self.tax_estimate(result.scenario.tax_rules, cgains)
+                print("%s%-10s %9d %16s %16s %s%16s%s %16s %16s" % (
+                    Fore.WHITE,
+                    tax_year_label,
+                    cgains.summary['disposals'],
+                    ReportLog.format_value(cgains.totals['proceeds']),
+                    ReportLog.format_value(cgains.totals['cost'] + cgains.totals['fees']),
+                    Fore.RED if cgains.totals['gain'] < 0 else Fore.WHITE,
+                    ReportLog.format_value(cgains.totals['gain']),
+                    Fore.WHITE,
+                    ReportLog.format_value(tax_lower) if tax_lower is not None else 'n/a',
+                    ReportLog.format_value(tax_higher)))
+
+    @staticmethod
+    def tax_estimate(tax_rules, cgains):
+        if tax_rules in config.TAX_RULES_UK_COMPANY:
+            return cgains.estimate.get('ct_small'), cgains.estimate['ct_main']
+        return cgains.estimate['cgt_basic'], cgains.estimate['cgt_higher']
+
 class ProgressSpinner:
     def __init__(self):
         self.spinner = itertools.cycle(['-', '\\', '|', '/'])
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+# (c) Nano Nano Ltd 2022
+
+import sys
+import copy
+import multiprocessing
+
+from colorama import Fore
+from tqdm import tqdm
+
+from .config import config
+from .transactions import TransactionHistory
+from .tax import TaxCalculator, CalculateCapitalGains as CCG, _init_worker
+
+class Scenario(object):
+    # Settings which can be varied, these only change how transaction records are valued
+    CONFIG_NAMES = ('trade_asset_type', 'trade_allowable_cost_type')
+
+    def __init__(self, tax_rules, settings=None):
+        self.tax_rules = tax_rules
+        self.settings = settings or {}
+        self.saved = None
+
+    @classmethod
+    def parse(cls, value):
+        # i.e. UK_COMPANY_MAR:trade_asset_type=1,trade_allowable_cost_type=0
+        tax_rules, _, settings = value.partition(':')
+        tax_rules = tax_rules.upper()
+
+        if tax_rules not in [config.TAX_RULES_UK_INDIVIDUAL] + config.TAX_RULES_UK_COMPANY:
+            raise ValueError("tax rules %s is not recognised" % repr(tax_rules))
+
+        scenario = cls(tax_rules)
+        for setting in settings.split(',') if settings else []:
+            name, _, setting_value = setting.partition('=')
+            name = name.strip().lower()
+
+            if name not in cls.CONFIG_NAMES:
+                raise ValueError("setting %s cannot be changed, use {%s}" % (
+                    repr(name), ','.join(cls.CONFIG_NAMES)))
+
+            try:
+                scenario.settings[name] = int(setting_value)
+            except ValueError:
+                raise ValueError("setting %s must be a number" % repr(name))
+
+        return scenario
+
+    def valuation_key(self):
+        # Scenarios with the same settings can share the same valued transactions
+        return tuple(self.settings.get(name, getattr(config, name)) for name in self.CONFIG_NAMES)
+
+    def __str__(self):
+        return ' '.join([self.tax_rules] + ['%s=%s' % (name, self.settings[name])
+                                            for name in sorted(self.settings)])
+
+    def __enter__(self):
+        self.saved = (config.start_of_year_month, config.start_of_year_day, dict(config.config))
+
+        if self.tax_rules in config.TAX_RULES_UK_COMPANY:
+            config.start_of_year_month = config.TAX_RULES_UK_COMPANY.index(self.tax_rules) + 1
+            config.start_of_year_day = 1
+        else:
+            config.start_of_year_month = 4
+            config.start_of_year_day = 6
+
+        config.config.update(self.settings)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_traceback):
+        config.start_of_year_month, config.start_of_year_day, config.config = self.saved
+
+class ScenarioResult(object):
+    def __init__(self, scenario, tax):
+        self.scenario = scenario
+        self.holdings = tax.holdings
+        self.tax_years = {}
+
+        for tax_year in sorted(tax.tax_report):
+            self.tax_years[tax_year] = (config.format_tax_year(tax_year),
+                                        tax.tax_report[tax_year]['CapitalGains'])
+
+def process_scenarios(transaction_records, scenarios, value_asset, skip_integrity_check, jobs):
+    # Transaction records are valued once for each combination of settings, all using the same
+    #  price data, then only the tax calculation is repeated for each scenario
+    transactions = {}
+
+    for scenario in scenarios:
+        key = scenario.valuation_key()
+        if key not in transactions:
+            with scenario:
+                # Valuing a transaction record changes it, so each needs its own copy
+                transactions[key] = TransactionHistory([copy.copy(tr)
+                                                        for tr in transaction_records],
+                                                       value_asset).transactions
+
+    tasks = [(scenario,
+              transactions[scenario.valuation_key()],
+              skip_integrity_check) for scenario in scenarios]
+
+    if jobs > 1 and len(tasks) > 1:
+        pool = multiprocessing.Pool(min(jobs, len(tasks)), initializer=_init_worker,
+                                    initargs=(config.__dict__,))
+        try:
+            return list(tqdm(pool.imap(_process_scenario, tasks),
+                             total=len(tasks),
+                             unit='scenario',
+                             desc="%sprocess scenarios%s" % (Fore.CYAN, Fore.GREEN),
+                             disable=bool(config.debug or not sys.stdout.isatty())))
+        finally:
+            pool.close()
+            pool.join()
+
+    return [_process_scenario(task) for task in tasks]
+
+def _process_scenario(args):
+    scenario, transactions, skip_integrity_check = args
+
+    with scenario:
+        tax = TaxCalculator(transactions, scenario.tax_rules)
+        tax.process_disposals(skip_integrity_check)
+
+        for tax_year in sorted(tax.tax_events):
+            if tax_year in CCG.CG_DATA_INDIVIDUAL:
+                tax.calculate_capital_gains(tax_year)
+
+        return ScenarioResult(scenario, tax)
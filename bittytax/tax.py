@@ -1,8 +1,10 @@
 # -*- coding: utf-8 -*-
 # (c) Nano Nano Ltd 2019
 
+import os
 import sys
 import copy
+import multiprocessing
 from decimal import Decimal
 from datetime import datetime, timedelta
 
@@ -12,6 +14,7 @@ from tqdm import tqdm
 from .config import config
 from .transactions import Buy, Sell
 from .holdings import Holdings
+from .fixedpoint import FixedPoint
 
 PRECISION = Decimal('0.00')
 
@@ -32,11 +35,28 @@ class TaxCalculator(object):
     # These transactions are except from the "same day" & "bnb" rule
     NO_MATCH_TYPES = (Sell.TYPE_GIFT_SPOUSE, Sell.TYPE_CHARITY_SENT, Sell.TYPE_LOST)
 
-    def __init__(self, transactions, tax_rules):
+    # Order in which disposals are found when all assets are processed together
+    DISPOSAL_ORDER = {DISPOSAL_SAME_DAY: 0,
+                      DISPOSAL_BED_AND_BREAKFAST: 1,
+                      DISPOSAL_TEN_DAY: 1,
+                      DISPOSAL_SECTION_104: 2,
+                      DISPOSAL_NO_GAIN_NO_LOSS: 2}
+
+    def __init__(self, transactions, tax_rules, fixed_point=False):
         self.transactions = transactions
         self.tax_rules = tax_rules
-        self.buys_ordered = []
-        self.sells_ordered = []
+        self.fixed_point = FixedPoint(transactions) if fixed_point else None
+        self.zero = 0 if fixed_point else Decimal(0)
+        if fixed_point:
+            self.split_buy = self.fixed_point.split_buy
+            self.split_sell = self.fixed_point.split_sell
+            self.capital_gains = self._capital_gains_fixed
+        else:
+            self.split_buy = Buy.split_buy
+            self.split_sell = Sell.split_sell
+            self.capital_gains = TaxEventCapitalGains
+        self.buys_ordered = OrderedTransactions()
+        self.sells_ordered = OrderedTransactions()
         self.other_transactions = []
 
         self.tax_events = {}
@@ -46,10 +66,13 @@ class TaxCalculator(object):
         self.holdings_report = {}
 
     def pool_same_day(self):
-        transactions = copy.deepcopy(self.transactions)
+        transactions = [copy.copy(t) for t in self.transactions]
         buy_transactions = {}
         sell_transactions = {}
 
+        if self.fixed_point:
+            self.fixed_point.convert(transactions)
+
         if config.debug:
             print("%spool same day transactions" % Fore.CYAN)
 
@@ -70,8 +93,8 @@ class TaxCalculator(object):
             else:
                 self.other_transactions.append(t)
 
-        self.buys_ordered = sorted(buy_transactions.values())
-        self.sells_ordered = sorted(sell_transactions.values())
+        self.buys_ordered = OrderedTransactions(buy_transactions.values())
+        self.sells_ordered = OrderedTransactions(sell_transactions.values())
 
         if config.debug:
             for t in sorted(self.all_transactions()):
@@ -84,8 +107,6 @@ class TaxCalculator(object):
             print("%spool: total transactions=%d" % (Fore.CYAN, len(self.all_transactions())))
 
     def match_buyback(self, rule):
-        sell_index = buy_index = 0
-
         if not self.buys_ordered:
             return
 
@@ -97,12 +118,17 @@ class TaxCalculator(object):
                     desc="%smatch %s transactions%s" % (Fore.CYAN, rule.lower(), Fore.GREEN),
                     disable=bool(config.debug or not sys.stdout.isatty()))
 
-        while sell_index < len(self.sells_ordered):
-            s = self.sells_ordered[sell_index]
-            b = self.buys_ordered[buy_index]
+        start_day, end_day = self._rule_window(rule)
+
+        for s in self.sells_ordered:
+            if not s.matched:
+                b = self.buys_ordered.find_unmatched(
+                    s.asset, s.timestamp.date() - timedelta(days=end_day),
+                    end_day - start_day + 1)
+            else:
+                b = None
 
-            if (not s.matched and not b.matched and s.asset == b.asset and
-                    self._rule_match(b.timestamp, s.timestamp, rule)):
+            if b:
                 if config.debug:
                     if b.quantity > s.quantity:
                         print("%smatch: %s" % (Fore.GREEN, s.__str__(quantity_bold=True)))
@@ -115,37 +141,29 @@ class TaxCalculator(object):
                         print("%smatch: %s" % (Fore.GREEN, b.__str__(quantity_bold=True)))
 
                 if b.quantity > s.quantity:
-                    b_remainder = b.split_buy(s.quantity)
-                    self.buys_ordered.insert(buy_index + 1, b_remainder)
+                    b_remainder = self.split_buy(b, s.quantity)
+                    self.buys_ordered.split(b, b_remainder)
                     if config.debug:
                         print("%smatch:   split: %s" % (Fore.YELLOW, b.__str__(quantity_bold=True)))
                         print("%smatch:   split: %s" % (Fore.YELLOW, b_remainder))
                 elif s.quantity > b.quantity:
-                    s_remainder = s.split_sell(b.quantity)
-                    self.sells_ordered.insert(sell_index + 1, s_remainder)
+                    s_remainder = self.split_sell(s, b.quantity)
+                    self.sells_ordered.split(s, s_remainder)
                     if config.debug:
                         print("%smatch:   split: %s" % (Fore.YELLOW, s.__str__(quantity_bold=True)))
                         print("%smatch:   split: %s" % (Fore.YELLOW, s_remainder))
                     pbar.total += 1
 
                 s.matched = b.matched = True
-                tax_event = TaxEventCapitalGains(rule, b, s, b.cost,
-                                                 (b.fee_value or Decimal(0)) +
-                                                 (s.fee_value or Decimal(0)))
+                tax_event = self.capital_gains(rule, b, s, b.cost,
+                                               (b.fee_value or self.zero) +
+                                               (s.fee_value or self.zero))
                 self.tax_events[self.which_tax_year(tax_event.date)].append(tax_event)
                 if config.debug:
                     print("%smatch:   %s" % (Fore.CYAN, tax_event))
 
-                # Find next sell
-                sell_index += 1
-                pbar.update(1)
-                buy_index = 0
-            else:
-                buy_index += 1
-                if buy_index >= len(self.buys_ordered):
-                    sell_index += 1
-                    pbar.update(1)
-                    buy_index = 0
+            # Find next sell
+            pbar.update(1)
 
         pbar.close()
 
@@ -153,8 +171,6 @@ class TaxCalculator(object):
             print("%smatch: total transactions=%d" % (Fore.CYAN, len(self.all_transactions())))
 
     def match_sell(self, rule):
-        buy_index = sell_index = 0
-
         if not self.sells_ordered:
             return
 
@@ -166,12 +182,17 @@ class TaxCalculator(object):
                     desc="%smatch %s transactions%s" % (Fore.CYAN, rule.lower(), Fore.GREEN),
                     disable=bool(config.debug or not sys.stdout.isatty()))
 
-        while buy_index < len(self.buys_ordered):
-            b = self.buys_ordered[buy_index]
-            s = self.sells_ordered[sell_index]
+        start_day, end_day = self._rule_window(rule)
+
+        for b in self.buys_ordered:
+            if not b.matched:
+                s = self.sells_ordered.find_unmatched(
+                    b.asset, b.timestamp.date() + timedelta(days=start_day),
+                    end_day - start_day + 1)
+            else:
+                s = None
 
-            if (not b.matched and not s.matched and b.asset == s.asset and
-                    self._rule_match(b.timestamp, s.timestamp, rule)):
+            if s:
                 if config.debug:
                     if b.quantity > s.quantity:
                         print("%smatch: %s" % (Fore.GREEN, b))
@@ -184,59 +205,149 @@ class TaxCalculator(object):
                         print("%smatch: %s" % (Fore.GREEN, s.__str__(quantity_bold=True)))
 
                 if b.quantity > s.quantity:
-                    b_remainder = b.split_buy(s.quantity)
-                    self.buys_ordered.insert(buy_index + 1, b_remainder)
+                    b_remainder = self.split_buy(b, s.quantity)
+                    self.buys_ordered.split(b, b_remainder)
                     if config.debug:
                         print("%smatch:   split: %s" % (Fore.YELLOW, b.__str__(quantity_bold=True)))
                         print("%smatch:   split: %s" % (Fore.YELLOW, b_remainder))
                     pbar.total += 1
                 elif s.quantity > b.quantity:
-                    s_remainder = s.split_sell(b.quantity)
-                    self.sells_ordered.insert(sell_index + 1, s_remainder)
+                    s_remainder = self.split_sell(s, b.quantity)
+                    self.sells_ordered.split(s, s_remainder)
                     if config.debug:
                         print("%smatch:   split: %s" % (Fore.YELLOW, s.__str__(quantity_bold=True)))
                         print("%smatch:   split: %s" % (Fore.YELLOW, s_remainder))
 
                 b.matched = s.matched = True
-                tax_event = TaxEventCapitalGains(rule, b, s, b.cost,
-                                                 (b.fee_value or Decimal(0)) +
-                                                 (s.fee_value or Decimal(0)))
+                tax_event = self.capital_gains(rule, b, s, b.cost,
+                                               (b.fee_value or self.zero) +
+                                               (s.fee_value or self.zero))
                 self.tax_events[self.which_tax_year(tax_event.date)].append(tax_event)
                 if config.debug:
                     print("%smatch:   %s" % (Fore.CYAN, tax_event))
 
-                # Find next buy
-                buy_index += 1
-                pbar.update(1)
-                sell_index = 0
-            else:
-                sell_index += 1
-                if sell_index >= len(self.sells_ordered):
-                    buy_index += 1
-                    pbar.update(1)
-                    sell_index = 0
+            # Find next buy
+            pbar.update(1)
 
         pbar.close()
 
         if config.debug:
             print("%smatch: total transactions=%d" % (Fore.CYAN, len(self.all_transactions())))
 
-    def _rule_match(self, b_timestamp, s_timestamp, rule):
+    def _rule_window(self, rule):
+        # Range of days, from the buy date to the sell date, which the rule matches
         if rule == self.DISPOSAL_SAME_DAY:
-            return b_timestamp.date() == s_timestamp.date()
+            return 0, 0
         if rule == self.DISPOSAL_TEN_DAY:
             # 10 days between buy and sell
-            return (b_timestamp.date() < s_timestamp.date() and
-                    s_timestamp.date() <= b_timestamp.date() + timedelta(days=10))
+            return 1, 10
         if rule == self.DISPOSAL_BED_AND_BREAKFAST:
             # 30 days between sell and buy-back
-            return (s_timestamp.date() < b_timestamp.date() and
-                    b_timestamp.date() <= s_timestamp.date() + timedelta(days=30))
-        if not rule:
-            return True
+            return -30, -1
 
         raise Exception
 
+    def process_disposals(self, skip_integrity_check):
+        self.pool_same_day()
+        self.match_sell(self.DISPOSAL_SAME_DAY)
+
+        if self.tax_rules == config.TAX_RULES_UK_INDIVIDUAL:
+            self.match_buyback(self.DISPOSAL_BED_AND_BREAKFAST)
+        elif self.tax_rules in config.TAX_RULES_UK_COMPANY:
+            self.match_sell(self.DISPOSAL_TEN_DAY)
+
+        self.process_section104(skip_integrity_check)
+
+        if self.fixed_point:
+            self.fixed_point.to_decimal_holdings(self.holdings)
+
+    def process_disposals_by_asset(self, skip_integrity_check, jobs=1, tax_state=None):
+        # Each asset is matched and pooled independently, so can be processed separately
+        transactions_by_asset = {}
+        for t in self.transactions:
+            if t.asset not in transactions_by_asset:
+                transactions_by_asset[t.asset] = []
+
+            transactions_by_asset[t.asset].append(t)
+
+        assets = sorted(transactions_by_asset)
+        results = {}
+        digests = {}
+
+        if tax_state:
+            settings = tax_state.settings(self.tax_rules,
+                                          skip_integrity_check,
+                                          bool(self.fixed_point))
+            for asset in assets:
+                digests[asset] = tax_state.digest(transactions_by_asset[asset], settings)
+                result = tax_state.load(digests[asset])
+                if result is not None:
+                    results[asset] = result
+                    if result[1][asset].mismatches:
+                        # The warnings were only output when the asset was first processed
+                        result[1][asset].warn_transfer_mismatch()
+
+            print("%sincremental: %d of %d assets unchanged" % (
+                Fore.CYAN, len(results), len(assets)))
+
+        pending = [asset for asset in assets if asset not in results]
+
+        if jobs > 1 and len(pending) > 1:
+            tasks = [(transactions_by_asset[asset],
+                      self.tax_rules,
+                      skip_integrity_check,
+                      bool(self.fixed_point)) for asset in pending]
+            pool = multiprocessing.Pool(jobs, initializer=_init_worker,
+                                        initargs=(config.__dict__,))
+            try:
+                results.update(zip(pending,
+                                   tqdm(pool.imap(_process_asset,
+                                                  tasks,
+                                                  chunksize=max(1, len(tasks) // (jobs * 4))),
+                                        total=len(tasks),
+                                        unit='asset',
+                                        desc="%sprocess assets%s" % (Fore.CYAN, Fore.GREEN),
+                                        disable=bool(config.debug or
+                                                     not sys.stdout.isatty()))))
+            finally:
+                pool.close()
+                pool.join()
+        elif pending:
+            tax = TaxCalculator([t for asset in pending for t in transactions_by_asset[asset]],
+                                self.tax_rules,
+                                bool(self.fixed_point))
+            tax.process_disposals(skip_integrity_check)
+
+            for asset in pending:
+                results[asset] = ({}, {asset: tax.holdings[asset]})
+
+            for tax_year in tax.tax_events:
+                for te in tax.tax_events[tax_year]:
+                    if tax_year not in results[te.asset][0]:
+                        results[te.asset][0][tax_year] = []
+
+                    results[te.asset][0][tax_year].append(te)
+
+        if tax_state:
+            for asset in pending:
+                tax_state.save(asset, settings, digests[asset], results[asset])
+
+            tax_state.save_index()
+
+        for asset in assets:
+            tax_events, holdings = results[asset]
+            for tax_year in tax_events:
+                if tax_year not in self.tax_events:
+                    self.tax_events[tax_year] = []
+
+                self.tax_events[tax_year].extend(tax_events[tax_year])
+
+            self.holdings.update(holdings)
+
+        for tax_year in self.tax_events:
+            # Stable sort, so events remain ordered by asset within each rule
+            self.tax_events[tax_year].sort(key=lambda te: self.DISPOSAL_ORDER[te.disposal_type])
+
     def process_section104(self, skip_integrity_check):
         if config.debug:
             print("%sprocess section 104" % Fore.CYAN)
@@ -246,7 +357,10 @@ class TaxCalculator(object):
                       desc="%sprocess section 104%s" % (Fore.CYAN, Fore.GREEN),
                       disable=bool(config.debug or not sys.stdout.isatty())):
             if t.asset not in self.holdings:
-                self.holdings[t.asset] = Holdings(t.asset)
+                if self.fixed_point:
+                    self.holdings[t.asset] = self.fixed_point.holdings(t.asset)
+                else:
+                    self.holdings[t.asset] = Holdings(t.asset)
 
             if t.matched:
                 if config.debug:
@@ -268,26 +382,33 @@ class TaxCalculator(object):
 
     def _add_tokens(self, t):
         if not t.acquisition:
-            cost = fees = Decimal(0)
+            cost = fees = self.zero
         else:
             cost = t.cost
-            fees = t.fee_value or Decimal(0)
+            fees = t.fee_value or self.zero
 
         self.holdings[t.asset].add_tokens(t.quantity, cost, fees,
                                           t.t_type == Buy.TYPE_DEPOSIT)
 
     def _subtract_tokens(self, t, skip_integrity_check):
         if not t.disposal:
-            cost = fees = Decimal(0)
+            cost = fees = self.zero
         else:
-            if self.holdings[t.asset].quantity:
+            if self.holdings[t.asset].quantity and self.fixed_point:
+                cost = self.fixed_point.apportion(self.holdings[t.asset].cost,
+                                                  t.quantity,
+                                                  self.holdings[t.asset].quantity)
+                fees = self.fixed_point.apportion(self.holdings[t.asset].fees,
+                                                  t.quantity,
+                                                  self.holdings[t.asset].quantity)
+            elif self.holdings[t.asset].quantity:
                 cost = self.holdings[t.asset].cost * (t.quantity /
                                                       self.holdings[t.asset].quantity)
                 fees = self.holdings[t.asset].fees * (t.quantity /
                                                       self.holdings[t.asset].quantity)
             else:
                 # Should never happen, only if incorrect transaction records
-                cost = fees = Decimal(0)
+                cost = fees = self.zero
 
         self.holdings[t.asset].subtract_tokens(t.quantity, cost, fees,
                                                t.t_type == Sell.TYPE_WITHDRAWAL)
@@ -295,14 +416,19 @@ class TaxCalculator(object):
         if t.disposal:
             if t.t_type in self.NO_GAIN_NO_LOSS_TYPES:
                 # Change proceeds to make sure it balances
-                t.proceeds = cost.quantize(PRECISION) + (fees + (t.fee_value or
-                                                                 Decimal(0))).quantize(PRECISION)
+                if self.fixed_point:
+                    t.proceeds = self.fixed_point.quantize(cost, t.asset) + \
+                                 self.fixed_point.quantize(fees + (t.fee_value or self.zero),
+                                                           t.asset)
+                else:
+                    t.proceeds = cost.quantize(PRECISION) + \
+                                 (fees + (t.fee_value or self.zero)).quantize(PRECISION)
                 t.proceeds_fixed = True
-                tax_event = TaxEventCapitalGains(self.DISPOSAL_NO_GAIN_NO_LOSS,
-                                                 None, t, cost, fees + (t.fee_value or Decimal(0)))
+                tax_event = self.capital_gains(self.DISPOSAL_NO_GAIN_NO_LOSS,
+                                               None, t, cost, fees + (t.fee_value or self.zero))
             else:
-                tax_event = TaxEventCapitalGains(self.DISPOSAL_SECTION_104,
-                                                 None, t, cost, fees + (t.fee_value or Decimal(0)))
+                tax_event = self.capital_gains(self.DISPOSAL_SECTION_104,
+                                               None, t, cost, fees + (t.fee_value or self.zero))
 
             self.tax_events[self.which_tax_year(tax_event.date)].append(tax_event)
             if config.debug:
@@ -311,6 +437,10 @@ class TaxCalculator(object):
             if config.transfers_include and not skip_integrity_check:
                 self.holdings[t.asset].check_transfer_mismatch()
 
+    def _capital_gains_fixed(self, disposal_type, b, s, cost, fees):
+        s, cost, fees = self.fixed_point.disposal(s, cost, fees)
+        return TaxEventCapitalGains(disposal_type, b, s, cost, fees)
+
     def process_income(self):
         if config.debug:
             print("%sprocess income" % Fore.CYAN)
@@ -326,8 +456,8 @@ class TaxCalculator(object):
     def all_transactions(self):
         if not config.transfers_include:
             # Ordered so transfers appear before the fee spend in the log
-            return self.other_transactions + self.buys_ordered + self.sells_ordered
-        return self.buys_ordered + self.sells_ordered + self.other_transactions
+            return self.other_transactions + list(self.buys_ordered) + list(self.sells_ordered)
+        return list(self.buys_ordered) + list(self.sells_ordered) + self.other_transactions
 
     def calculate_capital_gains(self, tax_year):
         self.tax_report[tax_year] = {}
@@ -362,6 +492,10 @@ class TaxCalculator(object):
         if config.debug:
             print("%scalculating holdings" % Fore.CYAN)
 
+        value_asset.prefetch_latest([self.holdings[h].asset for h in self.holdings
+                                     if self.holdings[h].quantity > 0 or
+                                     config.show_empty_wallets])
+
         for h in tqdm(self.holdings,
                       unit='h',
                       desc="%scalculating holdings%s" % (Fore.CYAN, Fore.GREEN),
@@ -390,17 +524,66 @@ class TaxCalculator(object):
         self.holdings_report['totals'] = totals
 
     def which_tax_year(self, timestamp):
-        if timestamp > config.get_tax_year_end(timestamp.year):
-            tax_year = timestamp.year + 1
-        else:
-            tax_year = timestamp.year
+        tax_year = config.which_tax_year(timestamp)
 
         if tax_year not in self.tax_events:
             self.tax_events[tax_year] = []
 
         return tax_year
 
+def _init_worker(config_state):
+    # Worker processes might not inherit the config (i.e. if spawned), progress is shown by the
+    #  parent process
+    config.__dict__.update(config_state)
+    sys.stderr = open(os.devnull, 'w')
+
+def _process_asset(args):
+    transactions, tax_rules, skip_integrity_check, fixed_point = args
+    tax = TaxCalculator(transactions, tax_rules, fixed_point)
+    tax.process_disposals(skip_integrity_check)
+    return tax.tax_events, tax.holdings
+
+class OrderedTransactions(object):
+    # Pooled transactions ordered by asset and date, each one is followed by a chain of the
+    #  remainders split from it, so a split is an append rather than a list insert
+    def __init__(self, transactions=None):
+        self.keys = []
+        self.chains = {}
+        self.count = 0
+
+        for t in sorted(transactions or []):
+            key = (t.asset, t.timestamp.date())
+            if key not in self.chains:
+                self.keys.append(key)
+                self.chains[key] = []
+
+            self.chains[key].append(t)
+            self.count += 1
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        # Remainders split during iteration are picked up straight after the transaction
+        for key in self.keys:
+            for t in self.chains[key]:
+                yield t
+
+    def split(self, t, remainder):
+        # Only the last transaction in a chain is ever unmatched, so it is always the one split
+        self.chains[(t.asset, t.timestamp.date())].append(remainder)
+        self.count += 1
+
+    def find_unmatched(self, asset, start_date, days):
+        for date in (start_date + timedelta(days=n) for n in range(days)):
+            if (asset, date) in self.chains and not self.chains[(asset, date)][-1].matched:
+                return self.chains[(asset, date)][-1]
+
+        return None
+
 class TaxEvent(object):
+    __slots__ = ('date', 'asset')
+
     def __init__(self, date, asset):
         self.date = date
         self.asset = asset
@@ -415,6 +598,9 @@ class TaxEvent(object):
         return self.date < other.date
 
 class TaxEventCapitalGains(TaxEvent):
+    __slots__ = ('disposal_type', 'quantity', 'cost', 'fees', 'proceeds', 'gain',
+                 'acquisition_date')
+
     def __init__(self, disposal_type, b, s, cost, fees):
         super(TaxEventCapitalGains, self).__init__(s.timestamp, s.asset)
         self.disposal_type = disposal_type
@@ -441,6 +627,8 @@ class TaxEventCapitalGains(TaxEvent):
             config.sym() + '{:0,.2f}'.format(self.fees))
 
 class TaxEventIncome(TaxEvent):
+    __slots__ = ('type', 'quantity', 'amount', 'note', 'fees')
+
     def __init__(self, b):
         super(TaxEventIncome, self).__init__(b.timestamp, b.asset)
         self.type = b.t_type
@@ -557,8 +745,16 @@ class CalculateCapitalGains(object):
         end_date = config.get_tax_year_end(tax_year)
         day_count = (end_date - start_date).days + 1
 
-        for date in (start_date + timedelta(n) for n in range(day_count)):
-            small_rate, main_rate = self.get_ct_rate(date)
+        # Rates only change on 1st April, so they are only looked up once for each period
+        period_start = start_date
+        while period_start <= end_date:
+            period_end = datetime(period_start.year, 4, 1, tzinfo=config.TZ_LOCAL)
+            if period_end <= period_start:
+                period_end = datetime(period_start.year + 1, 4, 1, tzinfo=config.TZ_LOCAL)
+
+            period_end = min(period_end, end_date + timedelta(microseconds=1))
+            days = (period_end - period_start).days
+            small_rate, main_rate = self.get_ct_rate(period_start)
 
             if small_rate not in self.estimate['ct_small_rates']:
                 self.estimate['ct_small_rates'].append(small_rate)
@@ -569,14 +765,19 @@ class CalculateCapitalGains(object):
             if self.estimate['taxable_gain'] > 0:
                 if small_rate is None:
                     # Use main rate if there isn't a small rate
-                    self.estimate['ct_small'] += self.estimate['taxable_gain'] / day_count * \
-                                                 main_rate / 100
+                    ct_small_day = self.estimate['taxable_gain'] / day_count * main_rate / 100
                 else:
-                    self.estimate['ct_small'] += self.estimate['taxable_gain'] / day_count * \
-                                                 small_rate / 100
+                    ct_small_day = self.estimate['taxable_gain'] / day_count * small_rate / 100
+
+                ct_main_day = self.estimate['taxable_gain'] / day_count * main_rate / 100
+
+                # Each day's share is added separately, as the total for the period can round
+                #  to a different penny
+                for _ in range(days):
+                    self.estimate['ct_small'] += ct_small_day
+                    self.estimate['ct_main'] += ct_main_day
 
-                self.estimate['ct_main'] += self.estimate['taxable_gain'] / day_count * \
-                                            main_rate / 100
+            period_start = period_end
 
         if self.estimate['ct_small_rates'] == [None]:
             # No small rate so remove estimate
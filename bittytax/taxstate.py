@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+# (c) Nano Nano Ltd 2022
+
+import os
+import hashlib
+import pickle
+
+from colorama import Fore, Back
+
+from .version import __version__
+from .config import config
+from .transactions import Buy
+
+class TaxState(object):
+    # Results are stored by a digest of the asset's transactions, any change to them (or to the
+    #  settings used) gives a new digest, so those assets are processed again
+    def __init__(self, filename):
+        if not os.path.exists(config.STATE_DIR):
+            os.mkdir(config.STATE_DIR)
+
+        # Index of the latest digest for each asset and settings, so the state it replaces can
+        #  be removed, kept per transaction records file as each has its own assets
+        path = os.path.abspath(filename) if filename else '-'
+        self.index_filename = os.path.join(config.STATE_DIR, 'index-%s.pickle' % (
+            hashlib.sha1(path.encode('utf-8')).hexdigest()))
+        self.index = self._load(self.index_filename) or {}
+
+    @staticmethod
+    def settings(tax_rules, skip_integrity_check, fixed_point=False):
+        return (tax_rules,
+                skip_integrity_check,
+                fixed_point,
+                config.transfers_include,
+                config.start_of_year_month,
+                config.start_of_year_day)
+
+    @staticmethod
+    def digest(transactions, settings):
+        sha = hashlib.sha1()
+        sha.update(repr((__version__,) + settings).encode('utf-8'))
+
+        for t in transactions:
+            sha.update(repr((type(t).__name__,
+                             t.t_type,
+                             t.asset,
+                             str(t.quantity),
+                             str(t.cost if isinstance(t, Buy) else t.proceeds),
+                             str(t.fee_value),
+                             t.timestamp.isoformat())).encode('utf-8'))
+
+        return sha.hexdigest()
+
+    def load(self, digest):
+        return self._load(os.path.join(config.STATE_DIR, digest + '.pickle'))
+
+    def save(self, asset, settings, digest, result):
+        with open(os.path.join(config.STATE_DIR, digest + '.pickle'), 'wb') as state_file:
+            pickle.dump(result, state_file, 2)
+
+        replaced = self.index.get((asset, settings))
+        if replaced and replaced != digest:
+            try:
+                os.remove(os.path.join(config.STATE_DIR, replaced + '.pickle'))
+            except OSError:
+                pass
+
+        self.index[(asset, settings)] = digest
+
+    def save_index(self):
+        with open(self.index_filename, 'wb') as index_file:
+            pickle.dump(self.index, index_file, 2)
+
+    @staticmethod
+    def _load(filename):
+        if not os.path.exists(filename):
+            return None
+
+        try:
+            with open(filename, 'rb') as state_file:
+                return pickle.load(state_file)
+        except:
+            print("%sWARNING%s State could not be loaded: %s" % (
+                Back.YELLOW+Fore.BLACK, Back.RESET+Fore.YELLOW, filename))
+            return None
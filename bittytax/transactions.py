@@ -9,12 +9,15 @@ from tqdm import tqdm
 
 from .config import config
 from .record import TransactionRecord
+from .price.valueasset import PriceRequests
 
 class TransactionHistory(object):
     def __init__(self, transaction_records, value_asset):
         self.value_asset = value_asset
         self.transactions = []
 
+        self.prefetch_prices(transaction_records)
+
         if config.debug:
             print("%ssplit transaction records" % Fore.CYAN)
 
@@ -85,6 +88,20 @@ class TransactionHistory(object):
         if config.debug:
             print("%ssplit: total transactions=%d" % (Fore.CYAN, len(self.transactions)))
 
+    def prefetch_prices(self, transaction_records):
+        # Copies of the records are valued first, only to find which prices are needed, these
+        #  are then all fetched before the records themselves are valued
+        value_asset = self.value_asset
+        self.value_asset = PriceRequests()
+        try:
+            for tr in transaction_records:
+                self.get_all_values(copy.copy(tr))
+            requests = self.value_asset.requests
+        finally:
+            self.value_asset = value_asset
+
+        self.value_asset.prefetch_historical(requests)
+
     def get_all_values(self, tr):
         if tr.buy and tr.buy.acquisition and tr.buy.cost is None:
             if tr.sell:
@@ -179,7 +196,13 @@ class TransactionHistory(object):
 
         return value, fixed
 
+# Slot names of each transaction class, including those inherited
+_ALL_SLOTS = {}
+
 class TransactionBase(object):
+    __slots__ = ('tid', 't_record', 't_type', 'asset', 'quantity', 'fee_value', 'fee_fixed',
+                 'wallet', 'timestamp', 'note', 'matched', 'pooled')
+
     def __init__(self, t_type, asset, quantity):
         self.tid = None
         self.t_record = None
@@ -253,16 +276,32 @@ class TransactionBase(object):
     def __lt__(self, other):
         return (self.asset, self.timestamp) < (other.asset, other.timestamp)
 
+    @classmethod
+    def _all_slots(cls):
+        if cls not in _ALL_SLOTS:
+            _ALL_SLOTS[cls] = [k for c in cls.__mro__ for k in getattr(c, '__slots__', ())]
+        return _ALL_SLOTS[cls]
+
+    def __copy__(self):
+        cls = self.__class__
+        result = cls.__new__(cls)
+        for k in self._all_slots():
+            setattr(result, k, getattr(self, k))
+
+        # Pooled transactions are shared, only the list itself is copied
+        result.pooled = list(self.pooled)
+        return result
+
     def __deepcopy__(self, memo):
         cls = self.__class__
         result = cls.__new__(cls)
         memo[id(self)] = result
-        for k, v in self.__dict__.items():
+        for k in self._all_slots():
             if k == 't_record':
                 # Keep reference to the transaction record
-                setattr(result, k, v)
+                setattr(result, k, getattr(self, k))
             else:
-                setattr(result, k, copy.deepcopy(v, memo))
+                setattr(result, k, copy.deepcopy(getattr(self, k), memo))
         return result
 
 class Buy(TransactionBase):
@@ -279,6 +318,8 @@ class Buy(TransactionBase):
     ACQUISITION_TYPES = {TYPE_MINING, TYPE_STAKING, TYPE_INTEREST, TYPE_DIVIDEND,
                          TYPE_INCOME, TYPE_GIFT_RECEIVED, TYPE_AIRDROP, TYPE_TRADE}
 
+    __slots__ = ('acquisition', 'cost', 'cost_fixed')
+
     def __init__(self, t_type, buy_quantity, buy_asset, buy_value):
         super(Buy, self).__init__(t_type, buy_asset, buy_quantity)
         self.acquisition = bool(self.t_type in self.ACQUISITION_TYPES)
@@ -291,7 +332,7 @@ class Buy(TransactionBase):
 
     def __iadd__(self, other):
         if not self.pooled:
-            self.pooled.append(copy.deepcopy(self))
+            self.pooled.append(copy.copy(self))
 
         # Pool buys
         if self.asset != other.asset:
@@ -324,7 +365,7 @@ class Buy(TransactionBase):
         return self
 
     def split_buy(self, sell_quantity):
-        remainder = copy.deepcopy(self)
+        remainder = copy.copy(self)
 
         self.cost = self.cost * (sell_quantity / self.quantity)
 
@@ -380,6 +421,8 @@ class Sell(TransactionBase):
     DISPOSAL_TYPES = {TYPE_SPEND, TYPE_GIFT_SENT, TYPE_GIFT_SPOUSE, TYPE_CHARITY_SENT,
                       TYPE_LOST, TYPE_TRADE}
 
+    __slots__ = ('disposal', 'proceeds', 'proceeds_fixed')
+
     def __init__(self, t_type, sell_quantity, sell_asset, sell_value):
         super(Sell, self).__init__(t_type, sell_asset, sell_quantity)
         self.disposal = bool(self.t_type in self.DISPOSAL_TYPES)
@@ -392,7 +435,7 @@ class Sell(TransactionBase):
 
     def __iadd__(self, other):
         if not self.pooled:
-            self.pooled.append(copy.deepcopy(self))
+            self.pooled.append(copy.copy(self))
 
         # Pool sells
         if self.asset != other.asset:
@@ -425,7 +468,7 @@ class Sell(TransactionBase):
         return self
 
     def split_sell(self, buy_quantity):
-        remainder = copy.deepcopy(self)
+        remainder = copy.copy(self)
 
         self.proceeds = self.proceeds * (buy_quantity / self.quantity)
 